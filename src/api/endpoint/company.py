@@ -7,7 +7,7 @@ from typing import List
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, UploadFile, File
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from starlette.responses import RedirectResponse, JSONResponse
+from starlette.responses import RedirectResponse, JSONResponse, FileResponse
 
 from base.schemas import Message
 from api.utils.db import get_db
@@ -18,6 +18,9 @@ from user.models import User, UserRole
 from company import schemas
 from user.schemas import UserCreateByEmail
 from user.service import crud_user
+from poll.columnar import ColumnarExportUnavailable, get_company_parquet
+from poll.schemas import DistributedPolls
+from poll.service import distribute_poll_to_company
 
 # Logging
 logger = PollLogger(__name__)
@@ -128,6 +131,49 @@ def get_company_by_id(company_id: int, db: Session = Depends(get_db),
         raise HTTPException(status_code=400, detail="Errors while getting user polls with error: " + str(e))
 
 
+# endpoint for exporting responses of all ended company polls to Parquet
+@router.get("/companies/{company_id}/export/parquet", description='Endpoint to export company responses to Parquet')
+def export_company_responses_parquet(company_id: int, db: Session = Depends(get_db),
+                                     current_user: User = Depends(get_current_active_user)):
+    """Endpoint to export responses of all ended company polls to Parquet
+    :param company_id: int
+    :param db: Session
+    :param current_user: User with role superadmin or admin of the company
+    :return: Parquet file"""
+    if UserRole.SUPERADMIN.value not in current_user.roles:
+        get_current_user_with_roles(current_user, required_roles=[UserRole.ADMIN])
+        if current_user.company_id != company_id:
+            raise HTTPException(status_code=403, detail="The user doesn't have enough privileges")
+    try:
+        path, polls_count = get_company_parquet(db, company_id)
+    except ColumnarExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    if not polls_count:
+        raise HTTPException(status_code=404, detail="Company has no ended polls")
+    return FileResponse(path, media_type="application/vnd.apache.parquet",
+                        filename=f"company_{company_id}.parquet")
+
+
+# endpoint for distributing poll template to all company users
+@router.post("/companies/{company_id}/polls/{poll_id}/distribute",
+             description='Endpoint to copy poll to every active user of company', response_model=DistributedPolls)
+def distribute_company_poll(company_id: int, poll_id: int, db: Session = Depends(get_db),
+                            current_user: User = Depends(get_current_active_user)):
+    """Endpoint to copy poll of current user to every active user of the company as draft
+    :param company_id: int
+    :param poll_id: int
+    :param db: Session
+    :param current_user: User with role superadmin or admin of the company
+    :return: ids of created polls"""
+    if UserRole.SUPERADMIN.value not in current_user.roles:
+        get_current_user_with_roles(current_user, required_roles=[UserRole.ADMIN])
+        if current_user.company_id != company_id:
+            raise HTTPException(status_code=403, detail="The user doesn't have enough privileges")
+    poll_ids = distribute_poll_to_company(db, poll_id=poll_id, company_id=company_id, user_id=current_user.id)
+    result = DistributedPolls(message=f"Poll copied to {len(poll_ids)} users", poll_ids=poll_ids)
+    return JSONResponse(status_code=201, content=result.model_dump(by_alias=True))
+
+
 # endpoint for updating company by id
 @router.patch("/companies/{company_id}", description='Endpoint for updating company by id')
 def update_company_by_id(company_id: int, data: schemas.CompanyUpdate, db: Session = Depends(get_db),
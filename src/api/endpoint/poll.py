@@ -12,7 +12,7 @@ from core.jwt import create_anonymous_user_token
 # from pkg.celery.tasks.celery_app import schedule_monitor_sessions
 from poll.models import PollStatus
 
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse, FileResponse
 
 from poll.schemas import QuestionPage, Question, SinglePoll, SinglePollOut
 from api.utils.security import get_current_user, get_current_active_user, get_poll_session
@@ -20,6 +20,12 @@ from api.utils.db import get_db, get_mongo_db
 from poll import schemas, service
 from poll.service import crud_poll, create_user_session
 from poll.session_data import SessionData
+from poll.stats import iter_responses_ndjson
+from poll.export import iter_responses_csv, iter_responses_xlsx
+from poll.columnar import ColumnarExportUnavailable, get_poll_parquet
+from poll.crosstab import build_crosstab
+from poll.bulk_import import import_polls
+from core import config
 from user.models import User
 from user.schemas import UserBase
 from api.utils.logger import PollLogger
@@ -145,8 +151,24 @@ def clone_poll_by_id(poll_id: int,
         raise HTTPException(status_code=400, detail="Error while creating user poll:" + str(e))
 
 
+# endpoint for bulk import of user polls
+@router.post("/user_polls/import", response_model=schemas.PollImportReport)
+def import_user_polls(file: UploadFile = File(...),
+                      db: Session = Depends(get_db),
+                      user: User = Depends(get_current_active_user)):
+    """
+    Эндпойнт для массового импорта опросов из NDJSON файла или ZIP архива документов CreatePoll
+
+    :param file: NDJSON файл (опрос на строку) или ZIP архив с файлами .json / .ndjson
+    :param db: Сессия базы данных
+    :param user: Текущий активный пользователь
+    :return report Отчет с результатом импорта каждого документа
+    """
+    return import_polls(db=db, stream=file.file, user_id=user.id)
+
+
 # ednpoint for updating poll
-@router.put("/user_polls/{poll_id}", response_model=Message)
+@router.put("/user_polls/{poll_id}", response_model=schemas.PollUpdateResult)
 def update_poll(poll_id: int,
                 poll_data: schemas.UpdatePoll,
                 db: Session = Depends(get_db),
@@ -158,12 +180,12 @@ def update_poll(poll_id: int,
     :param poll_data Данные для обновления опроса
     :param db: Сессия базы данных
     :param user: Текущий активный пользователь
-    :return message Сообщение об  успешном удалении опроса
+    :return message Сообщение об  успешном обновлении опроса и примененные изменения
     """
     try:
-        poll = service.update_poll(db=db, poll_id=poll_id, poll=poll_data, user_id=user.id)
-        if poll:
-            return JSONResponse(status_code=201, content={"message": "Poll updated successfully"})
+        changeset = service.update_poll(db=db, poll_id=poll_id, poll=poll_data, user_id=user.id)
+        result = schemas.PollUpdateResult(message="Poll updated successfully", changes=changeset)
+        return JSONResponse(status_code=201, content=result.model_dump(by_alias=True))
     except HTTPException as e:
         return JSONResponse(status_code=e.status_code, content={"detail": e.detail})
     except Exception as e:
@@ -218,17 +240,15 @@ def delete_user_poll(poll_id: int, db: Session = Depends(get_db), user: User = D
 
 
 # Получение детальной информации об опросе
-@router.get("/user_polls/{poll_id}")
-def get_poll(poll_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)) -> SinglePoll:
+@router.get("/user_polls/{poll_id}", response_model=SinglePoll)
+def get_poll(poll_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
     """ Эндпойнт для полуения детальной информации об опросе включая все вопросы и варианты ответы на них
     :param poll_id: Идентификатор опроса
     :param db: Сессия базы данных
     :param user: Текущий активный пользователь
     :return poll  Опрос пользователя со всеми данными"""
-    poll = service.get_single_poll(db=db, poll_id=poll_id, user_id=user.id)
-    if not poll:
-        raise HTTPException(status_code=404, detail="Poll not found")
-    return poll
+    payload = service.get_single_poll_json(db=db, poll_id=poll_id, user_id=user.id)
+    return Response(content=payload, media_type="application/json")
 
 
 # Получение детальной информации об опросе UUID
@@ -259,6 +279,9 @@ def get_poll(uuid: UUID = Path(...),
             if db_mongo_session["answered"]:
                 raise HTTPException(status_code=403, detail="Вы уже прошли данный опрос!")
 
+    payload = service.get_published_poll_payload(db=db, uuid=uuid)
+    if payload is not None:
+        return Response(content=payload, media_type="application/json")
     poll = service.get_poll_by_uuid(db=db, uuid=uuid)
 
     return poll
@@ -326,12 +349,119 @@ def get_poll_stats_responses(poll_id: int, db: Session = Depends(get_db), user:
     :param user: Текущий активный пользователь
     :return: Список ответов на опрос"""
 
-    results = service.get_poll_stats_responses(db=db, poll_id=poll_id, user_id=user.id)
-    # results_data = jsonable_encoder(results)
-    # return schemas.PollResultsResponse(results=results_data)
     return service.get_poll_stats_responses(db=db, poll_id=poll_id, user_id=user.id)
 
 
+# endpoint for getting live choice counts
+@router.get("/user_polls/{poll_id}/live-counts", response_model=List[schemas.ChoiceTallyItem])
+def get_poll_live_counts(poll_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
+    """Эндпоинт текущих счетчиков вариантов ответа опубликованного опроса
+
+    :param poll_id: Идентификатор опроса
+    :param db: Сессия базы данных
+    :param user: Текущий активный пользователь
+    :return: Количество выборов каждого варианта ответа"""
+
+    return service.get_poll_live_counts(db=db, poll_id=poll_id, user_id=user.id)
+
+
+# endpoint for getting individual responses page by page
+@router.get("/user_polls/{poll_id}/responses", response_model=schemas.PollResponsesPage)
+def get_poll_responses(poll_id: int,
+                       cursor: Optional[int] = Query(None, description="nextCursor предыдущей страницы"),
+                       limit: int = Query(config.STATS_RESPONSES_PAGE_SIZE, ge=1,
+                                          le=config.STATS_RESPONSES_MAX_PAGE_SIZE),
+                       db: Session = Depends(get_db),
+                       user: User = Depends(get_current_active_user)):
+    """Эндпоинт для постраничного получения индивидуальных ответов на опрос
+
+    :param poll_id: Идентификатор опроса
+    :param cursor: Курсор nextCursor из предыдущей страницы
+    :param limit: Размер страницы
+    :param db: Сессия базы данных
+    :param user: Текущий активный пользователь
+    :return: Страница ответов и курсор следующей страницы"""
+
+    return service.get_poll_responses_page(db=db, poll_id=poll_id, user_id=user.id, after_id=cursor, limit=limit)
+
+
+# endpoint for streaming all individual responses as NDJSON
+@router.get("/user_polls/{poll_id}/responses/stream")
+def stream_poll_responses(poll_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
+    """Эндпоинт для потоковой выгрузки всех индивидуальных ответов на опрос в формате NDJSON
+
+    :param poll_id: Идентификатор опроса
+    :param db: Сессия базы данных
+    :param user: Текущий активный пользователь
+    :return: Поток строк JSON - по одному ответу на строку"""
+
+    service.get_ended_user_poll(db=db, poll_id=poll_id, user_id=user.id)
+    return StreamingResponse(iter_responses_ndjson(poll_id, config.STATS_RESPONSES_PAGE_SIZE),
+                             media_type="application/x-ndjson")
+
+
+# endpoint for exporting responses to CSV
+@router.get("/user_polls/{poll_id}/export/csv")
+def export_poll_responses_csv(poll_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
+    """Эндпоинт для потоковой выгрузки ответов в CSV - строка на участника, колонка на вопрос
+
+    :param poll_id: Идентификатор опроса
+    :param db: Сессия базы данных
+    :param user: Текущий активный пользователь
+    :return: CSV файл"""
+
+    service.get_ended_user_poll(db=db, poll_id=poll_id, user_id=user.id)
+    return StreamingResponse(iter_responses_csv(poll_id, config.EXPORT_BATCH_SIZE),
+                             media_type="text/csv; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="poll_{poll_id}.csv"'})
+
+
+# endpoint for exporting responses to XLSX
+@router.get("/user_polls/{poll_id}/export/xlsx")
+def export_poll_responses_xlsx(poll_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
+    """Эндпоинт для потоковой выгрузки ответов в XLSX - строка на участника, колонка на вопрос
+
+    :param poll_id: Идентификатор опроса
+    :param db: Сессия базы данных
+    :param user: Текущий активный пользователь
+    :return: XLSX файл"""
 
+    service.get_ended_user_poll(db=db, poll_id=poll_id, user_id=user.id)
+    return StreamingResponse(iter_responses_xlsx(poll_id, config.EXPORT_BATCH_SIZE),
+                             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                             headers={"Content-Disposition": f'attachment; filename="poll_{poll_id}.xlsx"'})
 
 
+# endpoint for exporting responses to Parquet
+@router.get("/user_polls/{poll_id}/export/parquet")
+def export_poll_responses_parquet(poll_id: int, db: Session = Depends(get_db),
+                                  user: User = Depends(get_current_active_user)):
+    """Эндпоинт для выгрузки ответов в Parquet для аналитики - строка на ответ с типизированными колонками
+
+    :param poll_id: Идентификатор опроса
+    :param db: Сессия базы данных
+    :param user: Текущий активный пользователь
+    :return: Parquet файл"""
+
+    service.get_ended_user_poll(db=db, poll_id=poll_id, user_id=user.id)
+    try:
+        path = get_poll_parquet(db, poll_id)
+    except ColumnarExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return FileResponse(path, media_type="application/vnd.apache.parquet", filename=f"poll_{poll_id}.parquet")
+
+
+# endpoint for cross-tabulation of ended poll results
+@router.post("/user_polls/{poll_id}/crosstab", response_model=schemas.CrossTabResponse)
+def get_poll_crosstab(poll_id: int, request: schemas.CrossTabRequest, db: Session = Depends(get_db),
+                      user: User = Depends(get_current_active_user)):
+    """Эндпоинт кросс-таблицы: как ответили на вопрос участники, выбравшие заданные варианты
+
+    :param poll_id: Идентификатор опроса
+    :param request: Фильтры сегмента, вопрос для распределения и вопрос для разбивки на сегменты
+    :param db: Сессия базы данных
+    :param user: Текущий активный пользователь
+    :return: Распределение ответов по сегментам"""
+
+    service.get_ended_user_poll(db=db, poll_id=poll_id, user_id=user.id)
+    return build_crosstab(db, poll_id, request)
@@ -2,7 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic.networks import EmailStr
 from starlette.status import HTTP_403_FORBIDDEN
 
-from api.utils.security import get_current_user_with_roles
+from api.utils.security import get_current_user_with_roles, get_current_active_user
+from db.executor import db_executor
+from poll.ingest import response_ingest_buffer
 from base.schemas import Message
 from user.schemas import User
 from user.models import User as DBUser, UserRole
@@ -24,3 +26,19 @@ def test_email(
     return {"message": "Test email sent"}
 
 
+@router.get("/db-executor")
+def db_executor_stats(current_user: DBUser = Depends(get_current_active_user)):
+    """
+    Метрики пула потоков для запросов к БД из async эндпойнтов
+    """
+    get_current_user_with_roles(current_user, required_roles=[UserRole.SUPERADMIN])
+    return db_executor.stats().to_dict()
+
+
+@router.get("/response-ingest")
+def response_ingest_stats(current_user: DBUser = Depends(get_current_active_user)):
+    """
+    Метрики буфера отложенной записи ответов, включая счетчики ошибок записи
+    """
+    get_current_user_with_roles(current_user, required_roles=[UserRole.SUPERADMIN])
+    return response_ingest_buffer.stats().to_dict()
@@ -9,9 +9,8 @@ from db.session import SessionLocal, db_session
 from fastapi.staticfiles import StaticFiles
 from api.utils.security import create_initial_user
 from company.scheduler import scheduler
-from pkg.mongo_tools.db import session_collection
+from pkg.mongo_tools.db import mongo_manager
 
-# from pkg.mongo_tools.db import mongo_manager
 
 app = FastAPI(
     title="TestDesk",
@@ -46,7 +45,7 @@ async def db_session_middleware(request: Request, call_next):
     response = Response("Internal server error", status_code=500)
     try:
         request.state.db = SessionLocal()
-        request.state.mongo_db = session_collection
+        request.state.mongo_db = mongo_manager.get_session_collection()
         response = await call_next(request)
     finally:
         request.state.db.close()
@@ -58,6 +57,7 @@ async def db_session_middleware(request: Request, call_next):
 @app.on_event("startup")
 async def startup_event():
     create_initial_user(db=db_session())
+    mongo_manager.connect()
     if not scheduler.running:
 
         scheduler.start()
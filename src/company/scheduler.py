@@ -1,3 +1,5 @@
+import functools
+import time
 from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -8,13 +10,35 @@ from api.utils.logger import PollLogger
 from core import config
 from db.session import SessionLocal
 from pkg.mongo_tools.db import get_mongo_collection
+from pkg.mongo_tools.leader import LeaderElection
 from poll.models import PollStatus, Poll, Response
+from poll.tally import reconcile_choice_tallies
 
 # Logging
 custom_logger = PollLogger(__name__)
 logger = PollLogger(__name__)
 
+# Задачи планировщика выполняет только воркер-лидер во всем кластере
+leader_election = LeaderElection(name="scheduler", ttl_seconds=config.SCHEDULER_LEADER_TTL_SECONDS)
 
+
+def leader_only(func):
+    """
+    Декоратор задачи планировщика - задача выполняется только на воркере-лидере
+
+    Синхронные задачи запускаются в отдельном потоке, чтобы не блокировать event loop.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not leader_election.is_leader:
+            return None
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args, **kwargs)
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+
+@leader_only
 def check_expired_invitations():
     """
     Запуск планировщика задач для проверки и удаления просроченных приглашений
@@ -44,38 +68,61 @@ def check_expired_invitations():
         db.close()
 
 
+@leader_only
 async def check_active_polls():
     """
-    Запуск планировщика задач для проверки активных опросов
+    Запуск планировщика задач для пометки истекших сессий
+
+    Все истекшие сессии помечаются одним update_many по частичному индексу expires_at,
+    поэтому стоимость прохода не зависит от количества опубликованных опросов.
     """
-    db = SessionLocal()
     collection = get_mongo_collection()
+    started_at = time.perf_counter()
     try:
+        result = await collection.update_many(
+            {"expired": False, "expires_at": {"$lte": datetime.utcnow()}},
+            {"$set": {"expired": True}}
+        )
+        elapsed = time.perf_counter() - started_at
         logger.info(event_type="Checking active polls",
                     obj="",
                     subj=f"{config.PROJECT_NAME}",
-                    action="",
-                    additional_info=""
-                    )
-        published_polls = db.query(Poll).filter(Poll.poll_status == PollStatus.PUBLISHED).all()
-        current_time = datetime.utcnow()
-        for poll in published_polls:
-            async for session in collection.find({"poll_uuid": str(poll.uuid), "expired": False}):
-                if 'expires_at' in session and session['expires_at'] is not None and session['expires_at'] < current_time:
-                    await collection.update_one(
-                            {"_id": session['_id']},
-                            {"$set": {"expired": True}}
+                    action=f"Sessions marked as expired: {result.modified_count}",
+                    additional_info=f"Duration: {elapsed:.3f} s"
                     )
-                    logger.info(f"Session {session['_id']} for poll {poll.uuid} has been marked as expired")
     except Exception as e:
         logger.error(f"Event Type: Проверка активных опросов | Object: {None}"
                      f"| Subject: {config.PROJECT_NAME} | Action: Ошибка при проверке активных опросов"
                      f"| Additional Information: {e}")
-    finally:
-        db.close()
+
+
+@leader_only
+def reconcile_poll_tallies():
+    """
+    Запуск планировщика задач для пересчета счетчиков вариантов ответа опубликованных опросов
+
+    Исправляет расхождения счетчиков choice_tally с сохраненными ответами.
+    """
+    started_at = time.perf_counter()
+    try:
+        polls_count = reconcile_choice_tallies()
+        elapsed = time.perf_counter() - started_at
+        logger.info(event_type="Reconciling choice tallies",
+                    obj="",
+                    subj=f"{config.PROJECT_NAME}",
+                    action=f"Polls reconciled: {polls_count}",
+                    additional_info=f"Duration: {elapsed:.3f} s"
+                    )
+    except Exception as e:
+        logger.error(f"Event Type: Пересчет счетчиков | Object: {None}"
+                     f"| Subject: {config.PROJECT_NAME} | Action: Ошибка при пересчете счетчиков вариантов ответа"
+                     f"| Additional Information: {e}")
 
 
 scheduler = AsyncIOScheduler()
+scheduler.add_job(leader_election.heartbeat, 'interval', seconds=config.SCHEDULER_LEADER_RENEW_SECONDS,
+                  next_run_time=datetime.now())
 scheduler.add_job(check_expired_invitations, 'interval', minutes=15)
-scheduler.add_job(check_active_polls, 'interval', seconds=5)
+scheduler.add_job(check_active_polls, 'interval', seconds=config.SESSION_SWEEP_INTERVAL_SECONDS)
+scheduler.add_job(reconcile_poll_tallies, 'interval', seconds=config.CHOICE_TALLY_RECONCILE_INTERVAL_SECONDS)
 scheduler.start()
@@ -36,6 +36,9 @@ BACKEND_CORS_ORIGINS = [
 # Data Base
 SQLALCHEMY_DATABASE_URI = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
 
+# Размер пула потоков для синхронных запросов к PostgreSQL из async эндпойнтов
+DB_EXECUTOR_MAX_WORKERS = int(os.getenv("DB_EXECUTOR_MAX_WORKERS", 10))
+
 
 PROJECT_NAME = "TestDesk"
 # SERVER_HOST = "http://127.0.0.1:5000"
@@ -63,6 +66,24 @@ MONGO_URI = os.getenv("MONGO_URI")
 MONGO_NAME = os.getenv("MONGO_NAME")
 MONGO_USER = os.getenv("MONGO_INITDB_ROOT_USERNAME")
 MONGO_PASSWORD = os.getenv("MONGO_INITDB_ROOT_PASSWORD")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 10000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 20000))
+# Write concern: число узлов или "majority"
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN", "1")
+MONGO_WRITE_CONCERN = int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+MONGO_WRITE_TIMEOUT_MS = int(os.getenv("MONGO_WRITE_TIMEOUT_MS", 5000))
+# Сколько дней хранить истекшие сессии до удаления TTL индексом
+MONGO_SESSION_RETENTION_DAYS = int(os.getenv("MONGO_SESSION_RETENTION_DAYS", 30))
+# Интервал страховочной пометки истекших сессий, сек - в срок их помечает poll.scheduler.deadline_scheduler
+SESSION_SWEEP_INTERVAL_SECONDS = int(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", 60))
+# Аренда лидера планировщика: продление и время жизни без продления, сек
+SCHEDULER_LEADER_RENEW_SECONDS = int(os.getenv("SCHEDULER_LEADER_RENEW_SECONDS", 5))
+SCHEDULER_LEADER_TTL_SECONDS = int(os.getenv("SCHEDULER_LEADER_TTL_SECONDS", 15))
+# Интервал перечитывания сроков опросов лидером, сек - так лидер узнает о сроках, назначенных на других воркерах
+POLL_DEADLINE_RESYNC_SECONDS = int(os.getenv("POLL_DEADLINE_RESYNC_SECONDS", 30))
 
 
 
@@ -77,6 +98,52 @@ REDIS_URL = os.getenv("REDIS_URL")
 BROKER_URL = os.getenv("BROKER_URL")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 
+# PUBLISHED POLL CACHE
+# Готовый JSON опубликованных опросов: LRU в памяти воркера и, если включено, Redis по REDIS_URL
+PUBLISHED_POLL_CACHE_SIZE = int(os.getenv("PUBLISHED_POLL_CACHE_SIZE", 512))
+PUBLISHED_POLL_LOCAL_TTL_SECONDS = float(os.getenv("PUBLISHED_POLL_LOCAL_TTL_SECONDS", 10))
+PUBLISHED_POLL_CACHE_TTL_SECONDS = int(os.getenv("PUBLISHED_POLL_CACHE_TTL_SECONDS", 600))
+PUBLISHED_POLL_CACHE_REDIS = os.getenv("PUBLISHED_POLL_CACHE_REDIS", "true").lower() == "true"
+
+# POLL RUNTIME
+# Максимальное количество скомпилированных опросов в LRU кэше для проверки ответов
+POLL_RUNTIME_CACHE_SIZE = int(os.getenv("POLL_RUNTIME_CACHE_SIZE", 256))
+# Время жизни скомпилированного опроса в кэше процесса, сек - ограничивает устаревание на других воркерах
+POLL_RUNTIME_CACHE_TTL_SECONDS = float(os.getenv("POLL_RUNTIME_CACHE_TTL_SECONDS", 10))
+# Количество опросов, матрицы результатов которых держатся в памяти для кросс-таблиц
+RESULTS_MATRIX_CACHE_SIZE = int(os.getenv("RESULTS_MATRIX_CACHE_SIZE", 32))
+
+# RESPONSE STORAGE
+# Формат хранения ответов новых опросов: response - строка на ответ, submission - строка на участника
+RESPONSE_STORAGE_MODE = os.getenv("RESPONSE_STORAGE_MODE", "response")
+# Интервал пересчета счетчиков choice_tally опубликованных опросов по сохраненным ответам
+CHOICE_TALLY_RECONCILE_INTERVAL_SECONDS = int(os.getenv("CHOICE_TALLY_RECONCILE_INTERVAL_SECONDS", 3600))
+
+# RESPONSE INGEST
+# sync - ответы пишутся в запросе, buffered - через буфер отложенной записи
+RESPONSE_INGEST_MODE = os.getenv("RESPONSE_INGEST_MODE", "sync")
+RESPONSE_INGEST_QUEUE_SIZE = int(os.getenv("RESPONSE_INGEST_QUEUE_SIZE", 10000))
+RESPONSE_INGEST_BATCH_SIZE = int(os.getenv("RESPONSE_INGEST_BATCH_SIZE", 1000))
+RESPONSE_INGEST_FLUSH_INTERVAL = float(os.getenv("RESPONSE_INGEST_FLUSH_INTERVAL", 1.0))
+RESPONSE_INGEST_PUT_TIMEOUT = float(os.getenv("RESPONSE_INGEST_PUT_TIMEOUT", 0.5))
+# Файл (NDJSON) для ответов из буфера, которые не удалось записать в БД даже по одному респонденту
+RESPONSE_INGEST_DEAD_LETTER_PATH = os.getenv("RESPONSE_INGEST_DEAD_LETTER_PATH", "var/response_ingest_dead_letter.ndjson")
+
+# POLL RESULTS
+# Размер страницы индивидуальных ответов и его максимум для запросов по курсору
+STATS_RESPONSES_PAGE_SIZE = int(os.getenv("STATS_RESPONSES_PAGE_SIZE", 500))
+STATS_RESPONSES_MAX_PAGE_SIZE = int(os.getenv("STATS_RESPONSES_MAX_PAGE_SIZE", 5000))
+# Размер пачки серверного курсора при выгрузке ответов в CSV и XLSX
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# Каталог дискового кэша Parquet выгрузок
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", "/tmp/poll_exports")
+
+# POLL IMPORT
+# Количество опросов в одной транзакции массового импорта
+POLL_IMPORT_CHUNK_SIZE = int(os.getenv("POLL_IMPORT_CHUNK_SIZE", 200))
+# Максимальный размер одного документа опроса - строки NDJSON или файла в ZIP, байт
+POLL_IMPORT_MAX_DOCUMENT_BYTES = int(os.getenv("POLL_IMPORT_MAX_DOCUMENT_BYTES", 1024 * 1024))
+
 # MEDIA CONFIG
 DEFAULT_AVATAR_PATH = f"{CLIENT_ORIGIN}/media/boy-avatar.png"
 
@@ -0,0 +1,111 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Callable, TypeVar
+
+from core import config
+from api.utils.logger import PollLogger
+
+# Logging
+logger = PollLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class DBExecutorStats:
+    """
+    Метрики пула потоков для синхронной работы с БД
+
+    Параметры
+    _____
+
+    max_workers:
+        Размер пула потоков
+    submitted:
+        Количество поставленных задач
+    completed:
+        Количество успешно выполненных задач
+    failed:
+        Количество задач завершившихся ошибкой
+    in_flight:
+        Задачи в очереди или в работе
+    wait_time_total:
+        Суммарное время ожидания свободного потока, сек
+    run_time_total:
+        Суммарное время выполнения задач, сек
+    """
+    max_workers: int
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    in_flight: int = 0
+    wait_time_total: float = 0.0
+    run_time_total: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class DBExecutor:
+    """
+    Ограниченный пул потоков для вызовов синхронного Session из async кода
+
+    Запросы к PostgreSQL выполняются в отдельных потоках и не блокируют
+    event loop, поэтому параллельные респонденты и запросы к MongoDB
+    не выстраиваются в очередь за одним запросом к БД.
+    """
+
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-executor")
+        self._stats = DBExecutorStats(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Выполнение синхронной функции в пуле потоков
+
+        :param func: синхронная функция работающая с БД
+        :return: результат функции
+        """
+        queued_at = time.perf_counter()
+        with self._lock:
+            self._stats.submitted += 1
+            self._stats.in_flight += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._call, queued_at, func, *args, **kwargs)
+        )
+
+    def _call(self, queued_at: float, func: Callable[..., T], *args, **kwargs) -> T:
+        started_at = time.perf_counter()
+        failed = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._stats.in_flight -= 1
+                self._stats.wait_time_total += started_at - queued_at
+                self._stats.run_time_total += finished_at - started_at
+                if failed:
+                    self._stats.failed += 1
+                else:
+                    self._stats.completed += 1
+
+    def stats(self) -> DBExecutorStats:
+        with self._lock:
+            return DBExecutorStats(**self._stats.to_dict())
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+        logger.info('DB executor stopped')
+
+
+db_executor = DBExecutor(max_workers=config.DB_EXECUTOR_MAX_WORKERS)
@@ -7,14 +7,17 @@ from api import routers
 from db.session import SessionLocal, db_session
 from fastapi.staticfiles import StaticFiles
 from api.utils.security import create_initial_user
-from company.scheduler import scheduler
-from pkg.mongo_tools.db import session_collection, get_mongo_collection
+from company.scheduler import scheduler, leader_election
+from core import config
+from poll.ingest import response_ingest_buffer
+from db.executor import db_executor
+from poll.scheduler import deadline_scheduler
+from pkg.mongo_tools.db import mongo_manager, ensure_session_indexes
 
 from user.models import User
 from poll.models import Poll
 from company.models import Company
 
-# from pkg.mongo_tools.db import mongo_manager
 app = FastAPI(
     title="TestDesk",
     description="TestDesk API - это сервис для создания и прохождения опросов.",
@@ -48,7 +51,7 @@ async def db_session_middleware(request: Request, call_next):
     response = Response("Internal server error", status_code=500)
     try:
         request.state.db = SessionLocal()
-        request.state.mongo_db = get_mongo_collection()
+        request.state.mongo_db = mongo_manager.get_session_collection()
         response = await call_next(request)
     finally:
         request.state.db.close()
@@ -58,13 +61,24 @@ async def db_session_middleware(request: Request, call_next):
 @app.on_event("startup")
 async def startup_event():
     create_initial_user(db=db_session())
+    mongo_manager.connect()
+    await ensure_session_indexes(mongo_manager.get_session_collection())
+    await deadline_scheduler.start(leader=leader_election)
     if not scheduler.running:
         scheduler.start()
+    if config.RESPONSE_INGEST_MODE == "buffered":
+        await response_ingest_buffer.start()
 
 
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     scheduler.shutdown()
+    await deadline_scheduler.stop()
+    await leader_election.resign()
+    # Сбрасываем в БД все ответы, накопленные в буфере
+    await response_ingest_buffer.stop()
+    db_executor.shutdown()
+    mongo_manager.close()
 
 
 app.include_router(routers.api_router, prefix="/api")
@@ -0,0 +1,36 @@
+"""Add poll results snapshot table
+
+Revision ID: 5d2e8c41f0a7
+Revises: bedcbe544093
+Create Date: 2026-10-18 09:12:44.301522
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8c41f0a7'
+down_revision = 'bedcbe544093'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('poll_results_snapshot',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('poll_id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.DateTime(), nullable=True, comment='Дата расчета'),
+                    sa.Column('response_count', sa.Integer(), nullable=False),
+                    sa.Column('respondent_count', sa.Integer(), nullable=False),
+                    sa.Column('data', sa.LargeBinary(), nullable=False, comment='Статистика в JSON сжатая zlib'),
+                    sa.ForeignKeyConstraint(['poll_id'], ['poll.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('poll_id')
+                    )
+    op.create_index(op.f('ix_poll_results_snapshot_id'), 'poll_results_snapshot', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_poll_results_snapshot_id'), table_name='poll_results_snapshot')
+    op.drop_table('poll_results_snapshot')
@@ -0,0 +1,50 @@
+"""Add choice_tally table with live choice counters
+
+Revision ID: 7c5e0b93a1f8
+Revises: e41b6a9d07c3
+Create Date: 2026-10-18 14:22:51.907310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c5e0b93a1f8'
+down_revision = 'e41b6a9d07c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('choice_tally',
+                    sa.Column('question_id', sa.Integer(), nullable=False),
+                    sa.Column('choice_id', sa.Integer(), nullable=False),
+                    sa.Column('count', sa.BigInteger(), nullable=False),
+                    sa.ForeignKeyConstraint(['choice_id'], ['choice.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('question_id', 'choice_id')
+                    )
+    # Начальные значения счетчиков по уже сохраненным ответам обоих форматов хранения
+    op.execute("""
+        INSERT INTO choice_tally (question_id, choice_id, count)
+        SELECT question_id, choice_id, count(*)
+        FROM response_choice
+        GROUP BY question_id, choice_id
+    """)
+    op.execute("""
+        INSERT INTO choice_tally (question_id, choice_id, count)
+        SELECT c.question_id, c.id, count(*)
+        FROM submission s
+        CROSS JOIN LATERAL jsonb_each(s.answers) AS answer(key, value)
+        CROSS JOIN LATERAL jsonb_array_elements_text(
+            CASE WHEN jsonb_typeof(answer.value -> 'choice') = 'array' THEN answer.value -> 'choice' ELSE '[]'::jsonb END
+        ) AS selected(value)
+        JOIN choice c ON c.id::text = selected.value AND c.question_id::text = answer.key
+        GROUP BY c.question_id, c.id
+        ON CONFLICT (question_id, choice_id) DO UPDATE SET count = choice_tally.count + excluded.count
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('choice_tally')
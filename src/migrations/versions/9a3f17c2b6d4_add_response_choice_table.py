@@ -0,0 +1,47 @@
+"""Add response_choice table and backfill it from response.answer_choice
+
+Revision ID: 9a3f17c2b6d4
+Revises: 5d2e8c41f0a7
+Create Date: 2026-10-18 11:40:03.118245
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3f17c2b6d4'
+down_revision = '5d2e8c41f0a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('response_choice',
+                    sa.Column('response_id', sa.Integer(), nullable=False),
+                    sa.Column('choice_id', sa.Integer(), nullable=False),
+                    sa.Column('question_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['choice_id'], ['choice.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['response_id'], ['response.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('response_id', 'choice_id')
+                    )
+    # Перенос выбранных вариантов из JSON массивов, id вариантов других вопросов и удаленных вариантов пропускаются
+    op.execute("""
+        INSERT INTO response_choice (response_id, question_id, choice_id)
+        SELECT DISTINCT r.id, r.question_id, c.id
+        FROM response r
+        CROSS JOIN LATERAL jsonb_array_elements_text(
+            CASE WHEN jsonb_typeof(r.answer_choice::jsonb) = 'array' THEN r.answer_choice::jsonb ELSE '[]'::jsonb END
+        ) AS answer(value)
+        JOIN choice c ON c.id::text = answer.value AND c.question_id = r.question_id
+    """)
+    op.create_index('ix_response_choice_question_id_choice_id', 'response_choice', ['question_id', 'choice_id'],
+                    unique=False)
+    op.create_index('ix_response_choice_choice_id', 'response_choice', ['choice_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_response_choice_choice_id', table_name='response_choice')
+    op.drop_index('ix_response_choice_question_id_choice_id', table_name='response_choice')
+    op.drop_table('response_choice')
@@ -0,0 +1,44 @@
+"""Add submission table and response_storage to Poll
+
+Revision ID: e41b6a9d07c3
+Revises: 9a3f17c2b6d4
+Create Date: 2026-10-18 13:05:27.664019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b6a9d07c3'
+down_revision = '9a3f17c2b6d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('poll', sa.Column('response_storage', sa.String(length=16), server_default='response',
+                                    nullable=False, comment='Формат хранения ответов'))
+    op.create_table('submission',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.DateTime(), nullable=True),
+                    sa.Column('poll_id', sa.Integer(), nullable=False),
+                    sa.Column('user_token', sa.String(), nullable=False),
+                    sa.Column('answers', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+                    sa.ForeignKeyConstraint(['poll_id'], ['poll.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index(op.f('ix_submission_id'), 'submission', ['id'], unique=False)
+    op.create_index('ix_submission_poll_id_user_token', 'submission', ['poll_id', 'user_token'], unique=True)
+    op.create_index('ix_submission_answers', 'submission', ['answers'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'answers': 'jsonb_path_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_submission_answers', table_name='submission', postgresql_using='gin',
+                  postgresql_ops={'answers': 'jsonb_path_ops'})
+    op.drop_index('ix_submission_poll_id_user_token', table_name='submission')
+    op.drop_index(op.f('ix_submission_id'), table_name='submission')
+    op.drop_table('submission')
+    op.drop_column('poll', 'response_storage')
@@ -1,6 +1,11 @@
 from pymongo.errors import PyMongoError
-from motor.motor_asyncio import AsyncIOMotorClient
-from core.config import MONGO_URI, MONGO_NAME, MONGO_USER, MONGO_PASSWORD
+from typing import Optional
+
+from pymongo import WriteConcern, IndexModel, ASCENDING
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
+from core.config import MONGO_URI, MONGO_NAME, MONGO_USER, MONGO_PASSWORD, MONGO_MAX_POOL_SIZE, \
+    MONGO_MIN_POOL_SIZE, MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, \
+    MONGO_WRITE_CONCERN, MONGO_WRITE_TIMEOUT_MS
 from api.utils.logger import PollLogger
 from datetime import datetime
 
@@ -144,29 +149,84 @@ logger = PollLogger(__name__)
 # mongo_manager = DatabaseManager()
 
 
-client = AsyncIOMotorClient(
-                MONGO_URI,
-                username=MONGO_USER,
-                password=MONGO_PASSWORD,
-            )
-database = client[MONGO_NAME]
-session_collection = database.get_collection("sessions")
+class MongoManager:
+    """
+    Единый клиент MongoDB с пулом соединений на весь процесс
+
+    Клиент создается один раз при старте приложения и переиспользуется
+    всеми запросами и задачами планировщика.
+    """
+
+    def __init__(self):
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.db: Optional[AsyncIOMotorDatabase] = None
+
+    def connect(self) -> None:
+        if self.client is not None:
+            return
+        self.client = AsyncIOMotorClient(
+            MONGO_URI,
+            username=MONGO_USER,
+            password=MONGO_PASSWORD,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        )
+        write_concern = WriteConcern(w=MONGO_WRITE_CONCERN, wtimeout=MONGO_WRITE_TIMEOUT_MS)
+        self.db = self.client.get_database(MONGO_NAME, write_concern=write_concern)
+        logger.info(f"Connected to MongoDB, pool size {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE}")
+
+    def close(self) -> None:
+        if self.client is None:
+            return
+        self.client.close()
+        self.client = None
+        self.db = None
+        logger.info("Closed MongoDB connection.")
+
+    def get_database(self) -> AsyncIOMotorDatabase:
+        if self.db is None:
+            self.connect()
+        return self.db
+
+    def get_session_collection(self) -> AsyncIOMotorCollection:
+        return self.get_database().get_collection("sessions")
 
 
-def get_mongo_client():
-    client = AsyncIOMotorClient(
-                MONGO_URI,
-                username=MONGO_USER,
-                password=MONGO_PASSWORD,
-            )
-    return client
+mongo_manager = MongoManager()
 
 
 def get_mongo_collection():
-    client = get_mongo_client()
-    db = client[MONGO_NAME]
-    collection = database.get_collection("sessions")
-    return collection
+    return mongo_manager.get_session_collection()
+
+
+SESSION_INDEXES = [
+    IndexModel([("token", ASCENDING)], name="token_unique", unique=True),
+    IndexModel([("poll_uuid", ASCENDING), ("answered", ASCENDING)], name="poll_uuid_answered"),
+    IndexModel([("poll_uuid", ASCENDING), ("expired", ASCENDING)], name="poll_uuid_expired"),
+    # Для пометки истекших сессий одним update_many
+    IndexModel([("expires_at", ASCENDING)], name="expires_at_not_expired",
+               partialFilterExpression={"expired": False}),
+    # Документ удаляется MongoDB когда наступает время purge_at
+    IndexModel([("purge_at", ASCENDING)], name="purge_at_ttl", expireAfterSeconds=0),
+]
+
+
+async def ensure_session_indexes(collection: AsyncIOMotorCollection) -> None:
+    """
+    Создание индексов коллекции сессий при старте приложения
+
+    Операция идемпотентна - существующие индексы с теми же параметрами не пересоздаются.
+
+    :param collection: коллекция sessions
+    """
+    try:
+        names = await collection.create_indexes(SESSION_INDEXES)
+        logger.info(f"MongoDB session indexes are ready: {', '.join(names)}")
+    except PyMongoError as e:
+        logger.error(f"Error creating MongoDB session indexes: {e}")
 
 
 def session_helper(session) -> dict:
@@ -0,0 +1,85 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import uuid4
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from api.utils.logger import PollLogger
+from .db import mongo_manager
+
+# Logging
+logger = PollLogger(__name__)
+
+
+class LeaderElection:
+    """
+    Выбор лидера среди воркеров через документ-аренду в MongoDB
+
+    Каждый воркер периодически вызывает heartbeat. Аренду получает тот, кто первым
+    застал ее свободной или истекшей, и продлевает ее, пока жив. Если лидер
+    перестал продлевать аренду, через ttl секунд ее забирает другой воркер.
+
+    Параметры
+    _____
+
+    name:
+        Имя аренды - _id документа в коллекции leases
+    ttl_seconds:
+        Время жизни аренды без продления
+    """
+
+    def __init__(self, name: str, ttl_seconds: int):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self._lease_until: Optional[datetime] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lease_until is not None and datetime.utcnow() < self._lease_until
+
+    def _collection(self):
+        return mongo_manager.get_database().get_collection("leases")
+
+    async def heartbeat(self) -> bool:
+        """
+        Захват или продление аренды
+
+        :return: True если текущий воркер - лидер
+        """
+        was_leader = self.is_leader
+        now = datetime.utcnow()
+        lease_until = now + self.ttl
+        try:
+            await self._collection().find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner_id}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": self.owner_id, "expires_at": lease_until, "renewed_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            self._lease_until = lease_until
+        except DuplicateKeyError:
+            # Аренда занята другим воркером
+            self._lease_until = None
+        except PyMongoError as e:
+            logger.error(f"Error renewing leader lease {self.name}: {e}")
+            self._lease_until = None
+
+        if self.is_leader and not was_leader:
+            logger.info(f"Worker {self.owner_id} became leader of {self.name}")
+        elif was_leader and not self.is_leader:
+            logger.info(f"Worker {self.owner_id} lost leadership of {self.name}")
+        return self.is_leader
+
+    async def resign(self) -> None:
+        """ Освобождение аренды при остановке воркера"""
+        if self._lease_until is None:
+            return
+        self._lease_until = None
+        try:
+            await self._collection().delete_one({"_id": self.name, "owner": self.owner_id})
+        except PyMongoError as e:
+            logger.error(f"Error releasing leader lease {self.name}: {e}")
@@ -0,0 +1,115 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from api.utils.logger import PollLogger
+
+# Logging
+logger = PollLogger(__name__)
+
+# Сколько раз повторять захват места при гонке первой вставки счетчика
+ADMISSION_ATTEMPTS = 2
+
+
+def get_counters_collection(db_mongo: AsyncIOMotorCollection) -> AsyncIOMotorCollection:
+    """ Коллекция счетчиков участников - в той же базе что и сессии"""
+    return db_mongo.database.get_collection("poll_counters")
+
+
+async def ensure_poll_counter(db_mongo: AsyncIOMotorCollection, poll_uuid: str) -> None:
+    """
+    Создание счетчика опроса из уже существующих сессий
+
+    Подсчет выполняется один раз на опрос - для опросов, начатых до появления счетчиков.
+
+    :param db_mongo: коллекция сессий
+    :param poll_uuid: UUID опроса
+    """
+    counters = get_counters_collection(db_mongo)
+    if await counters.find_one({"_id": poll_uuid}, projection={"_id": True}):
+        return
+    admitted = await db_mongo.count_documents({"poll_uuid": poll_uuid})
+    completed = await db_mongo.count_documents({"poll_uuid": poll_uuid, "answered": True})
+    await counters.update_one(
+        {"_id": poll_uuid},
+        {"$setOnInsert": {"admitted": admitted, "completed": completed}},
+        upsert=True
+    )
+
+
+async def admit_participant(db_mongo: AsyncIOMotorCollection, poll_uuid: str, max_participants: int = None) -> bool:
+    """
+    Атомарный захват места участника опроса
+
+    Место занимается одним $inc с условием admitted < max_participants, поэтому
+    одновременные старты не могут превысить лимит.
+
+    :param db_mongo: коллекция сессий
+    :param poll_uuid: UUID опроса
+    :param max_participants: максимальное количество участников или None
+    :return: True если место получено
+    """
+    await ensure_poll_counter(db_mongo, poll_uuid)
+    counters = get_counters_collection(db_mongo)
+    query = {"_id": poll_uuid}
+    if max_participants is not None:
+        query["admitted"] = {"$lt": max_participants}
+    for _ in range(ADMISSION_ATTEMPTS):
+        try:
+            await counters.find_one_and_update(
+                query,
+                {"$inc": {"admitted": 1}, "$setOnInsert": {"completed": 0}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return True
+        except DuplicateKeyError:
+            # Счетчик уже есть и условие не выполнено - мест нет, либо проиграли гонку первой вставки
+            continue
+    return False
+
+
+async def release_participant(db_mongo: AsyncIOMotorCollection, poll_uuid: str) -> None:
+    """
+    Возврат места, если сессию не удалось создать
+
+    :param db_mongo: коллекция сессий
+    :param poll_uuid: UUID опроса
+    """
+    await get_counters_collection(db_mongo).update_one(
+        {"_id": poll_uuid, "admitted": {"$gt": 0}},
+        {"$inc": {"admitted": -1}}
+    )
+
+
+async def register_completed_participant(db_mongo: AsyncIOMotorCollection, poll_uuid: str) -> int:
+    """
+    Учет завершившего опрос участника
+
+    Вызывается после пометки сессии как answered.
+
+    :param db_mongo: коллекция сессий
+    :param poll_uuid: UUID опроса
+    :return: количество завершивших опрос с учетом текущего
+    """
+    counters = get_counters_collection(db_mongo)
+    counter = await counters.find_one_and_update(
+        {"_id": poll_uuid},
+        {"$inc": {"completed": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        # Счетчика еще нет - создаем его подсчетом сессий, текущая уже помечена как answered
+        await ensure_poll_counter(db_mongo, poll_uuid)
+        counter = await counters.find_one({"_id": poll_uuid})
+    return counter["completed"] if counter else 0
+
+
+async def reset_poll_counter(db_mongo: AsyncIOMotorCollection, poll_uuid: str) -> None:
+    """
+    Удаление счетчика вместе с сессиями опроса
+
+    :param db_mongo: коллекция сессий
+    :param poll_uuid: UUID опроса
+    """
+    await get_counters_collection(db_mongo).delete_one({"_id": poll_uuid})
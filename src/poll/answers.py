@@ -0,0 +1,197 @@
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import Session
+
+from . import models
+from .models import ResponseStorage
+
+
+class AnswerRow(NamedTuple):
+    """
+    Ответ на один вопрос независимо от формата хранения
+
+    Для формата submission answer_id - id анкеты, общий для всех ответов респондента.
+    """
+    answer_id: int
+    poll_id: int
+    question_id: int
+    answer_choice: Any
+    answer_text: Any
+    user_token: str
+    created_at: Optional[datetime]
+
+
+def get_response_storage(db: Session, poll_id: int) -> str:
+    storage = db.query(models.Poll.response_storage).filter(models.Poll.id == poll_id).scalar()
+    return storage or ResponseStorage.RESPONSE.value
+
+
+def split_by_storage(db: Session, poll_ids: List[int]) -> Dict[str, List[int]]:
+    """ id опросов по формату хранения ответов"""
+    polls = {}
+    for poll_id, storage in db.query(models.Poll.id, models.Poll.response_storage) \
+            .filter(models.Poll.id.in_(poll_ids)) \
+            .order_by(models.Poll.id):
+        polls.setdefault(storage or ResponseStorage.RESPONSE.value, []).append(poll_id)
+    return polls
+
+
+def expand_submission(submission_id: int, poll_id: int, user_token: str, created_at: Optional[datetime],
+                      answers: Dict[str, dict]) -> List[AnswerRow]:
+    """ Ответы анкеты в виде строк AnswerRow"""
+    return [
+        AnswerRow(submission_id, poll_id, int(question_id), answer.get("choice"), answer.get("text"),
+                  user_token, created_at)
+        for question_id, answer in answers.items()
+    ]
+
+
+def _response_batch(db: Session, poll_ids: List[int], after_id: Optional[int], limit: int) -> List[AnswerRow]:
+    query = db.query(
+        models.Response.id,
+        models.Response.poll_id,
+        models.Response.question_id,
+        models.Response.answer_choice,
+        models.Response.answer_text,
+        models.Response.user_token,
+        models.Response.created_at
+    ) \
+        .filter(models.Response.poll_id.in_(poll_ids))
+    if after_id is not None:
+        query = query.filter(models.Response.id > after_id)
+    return [AnswerRow(*row) for row in query.order_by(models.Response.id).limit(limit).all()]
+
+
+def _submission_batch(db: Session, poll_ids: List[int], after_id: Optional[int], limit: int) -> List[tuple]:
+    query = db.query(
+        models.Submission.id,
+        models.Submission.poll_id,
+        models.Submission.user_token,
+        models.Submission.created_at,
+        models.Submission.answers
+    ) \
+        .filter(models.Submission.poll_id.in_(poll_ids))
+    if after_id is not None:
+        query = query.filter(models.Submission.id > after_id)
+    return query.order_by(models.Submission.id).limit(limit).all()
+
+
+def fetch_answer_page(db: Session, poll_id: int, after_id: Optional[int],
+                      limit: int) -> Tuple[List[AnswerRow], Optional[int]]:
+    """
+    Страница ответов опроса по ключу id строки хранения
+
+    Для формата submission limit ограничивает количество анкет, ответы анкеты
+    не разрываются между страницами.
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param after_id: курсор - id последней строки предыдущей страницы
+    :param limit: размер страницы
+    :return: ответы и курсор следующей страницы
+    """
+    if get_response_storage(db, poll_id) == ResponseStorage.SUBMISSION:
+        submissions = _submission_batch(db, [poll_id], after_id, limit)
+        rows = [row for submission in submissions for row in expand_submission(*submission)]
+        next_cursor = submissions[-1][0] if len(submissions) == limit else None
+        return rows, next_cursor
+    rows = _response_batch(db, [poll_id], after_id, limit)
+    next_cursor = rows[-1].answer_id if len(rows) == limit else None
+    return rows, next_cursor
+
+
+def iter_answer_batches(db: Session, poll_ids: List[int], batch_size: int) -> Iterator[List[AnswerRow]]:
+    """
+    Все ответы опросов пачками по ключу id, опросы в разных форматах хранения читаются по очереди
+
+    :param db: сессия БД
+    :param poll_ids: id опросов
+    :param batch_size: размер пачки
+    :return: пачки ответов
+    """
+    for storage, storage_poll_ids in split_by_storage(db, poll_ids).items():
+        after_id = None
+        while True:
+            if storage == ResponseStorage.SUBMISSION:
+                submissions = _submission_batch(db, storage_poll_ids, after_id, batch_size)
+                fetched = len(submissions)
+                if submissions:
+                    after_id = submissions[-1][0]
+                rows = [row for submission in submissions for row in expand_submission(*submission)]
+            else:
+                rows = _response_batch(db, storage_poll_ids, after_id, batch_size)
+                fetched = len(rows)
+                if rows:
+                    after_id = rows[-1].answer_id
+            if rows:
+                yield rows
+            if fetched < batch_size:
+                break
+
+
+def iter_answers_by_respondent(db: Session, poll_id: int, batch_size: int) -> Iterator[AnswerRow]:
+    """
+    Ответы опроса, сгруппированные по респонденту, серверным курсором
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param batch_size: размер пачки курсора
+    :return: ответы, ответы одного респондента идут подряд
+    """
+    if get_response_storage(db, poll_id) == ResponseStorage.SUBMISSION:
+        submissions = db.query(
+            models.Submission.id,
+            models.Submission.poll_id,
+            models.Submission.user_token,
+            models.Submission.created_at,
+            models.Submission.answers
+        ) \
+            .filter(models.Submission.poll_id == poll_id) \
+            .order_by(models.Submission.id) \
+            .execution_options(stream_results=True) \
+            .yield_per(batch_size)
+        for submission in submissions:
+            yield from expand_submission(*submission)
+        return
+    rows = db.query(
+        models.Response.id,
+        models.Response.poll_id,
+        models.Response.question_id,
+        models.Response.answer_choice,
+        models.Response.answer_text,
+        models.Response.user_token,
+        models.Response.created_at
+    ) \
+        .filter(models.Response.poll_id == poll_id) \
+        .order_by(models.Response.user_token, models.Response.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(batch_size)
+    for row in rows:
+        yield AnswerRow(*row)
+
+
+def count_answers(db: Session, poll_id: int) -> Tuple[int, int]:
+    """
+    Количество ответов и респондентов опроса
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: (ответов, респондентов)
+    """
+    if get_response_storage(db, poll_id) == ResponseStorage.SUBMISSION:
+        answers_count, respondents = db.query(
+            func.coalesce(func.sum(func.jsonb_array_length(func.jsonb_path_query_array(
+                models.Submission.answers, literal_column("'$.*'::jsonpath")))), 0),
+            func.count(models.Submission.id)
+        ) \
+            .filter(models.Submission.poll_id == poll_id) \
+            .one()
+        return int(answers_count), respondents
+    return db.query(
+        func.count(models.Response.id),
+        func.count(func.distinct(models.Response.user_token))
+    ) \
+        .filter(models.Response.poll_id == poll_id) \
+        .one()
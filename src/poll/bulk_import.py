@@ -0,0 +1,223 @@
+import zipfile
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from core import config
+from api.utils.logger import PollLogger
+from . import models, schemas
+from .models import PollStatus
+from .diff import insert_question_rows, question_rows
+from .scheduler import deadline_scheduler
+
+# Logging
+logger = PollLogger(__name__)
+
+IMPORT_PENDING = "pending"
+IMPORT_CREATED = "created"
+IMPORT_INVALID = "invalid"
+IMPORT_FAILED = "failed"
+
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+Document = Tuple[str, Optional[bytes]]
+
+
+def _iter_ndjson(stream: BinaryIO, max_bytes: int, prefix: str = "") -> Iterator[Document]:
+    """
+    Документы NDJSON потока построчно, в памяти не больше одной строки
+
+    :param stream: бинарный поток
+    :param max_bytes: максимальный размер строки
+    :param prefix: префикс источника документа в отчете
+    :return: пары (источник, документ), документ None - строка длиннее max_bytes
+    """
+    line_number = 0
+    while True:
+        line = stream.readline(max_bytes + 1)
+        if not line:
+            break
+        line_number += 1
+        source = f"{prefix}line {line_number}"
+        if len(line) > max_bytes and not line.endswith(b"\n"):
+            # Остаток слишком длинной строки пропускается без чтения в память целиком
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_bytes + 1)
+            yield source, None
+            continue
+        if line.strip():
+            yield source, line
+
+
+def _iter_zip(stream: BinaryIO, max_bytes: int) -> Iterator[Document]:
+    """
+    Документы ZIP архива: файл .json - один опрос, файл .ndjson или .jsonl - опрос на строку
+
+    :param stream: бинарный поток архива
+    :param max_bytes: максимальный размер документа
+    :return: пары (источник, документ), документ None - файл или строка больше max_bytes
+    """
+    with zipfile.ZipFile(stream) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/"):
+                continue
+            if name.endswith(NDJSON_SUFFIXES):
+                with archive.open(info) as member:
+                    yield from _iter_ndjson(member, max_bytes, prefix=f"{name}: ")
+            elif name.endswith(".json"):
+                if info.file_size > max_bytes:
+                    yield name, None
+                    continue
+                with archive.open(info) as member:
+                    document = member.read(max_bytes + 1)
+                yield name, document if len(document) <= max_bytes else None
+
+
+def iter_import_documents(stream: BinaryIO, max_bytes: int) -> Iterator[Document]:
+    """
+    Документы опросов из загруженного файла - ZIP архива или NDJSON
+
+    :param stream: бинарный поток файла
+    :param max_bytes: максимальный размер документа
+    :return: пары (источник, документ)
+    """
+    stream.seek(0)
+    is_zip = zipfile.is_zipfile(stream)
+    stream.seek(0)
+    if is_zip:
+        yield from _iter_zip(stream, max_bytes)
+    else:
+        yield from _iter_ndjson(stream, max_bytes)
+
+
+def _validate(document: Optional[bytes], max_bytes: int) -> Tuple[Optional[schemas.CreatePoll], List[str]]:
+    if document is None:
+        return None, [f"Document exceeds {max_bytes} bytes"]
+    try:
+        return schemas.CreatePoll.model_validate_json(document), []
+    except ValidationError as e:
+        return None, [f"{'.'.join(str(loc) for loc in error['loc']) or 'document'}: {error['msg']}"
+                      for error in e.errors()]
+
+
+def _poll_values(poll: schemas.CreatePoll, user_id: int) -> dict:
+    """ Значения колонок нового опроса, как в create_new_poll"""
+    values = poll.model_dump(exclude={"question"})
+    values["poll_status"] = PollStatus(poll.poll_status.value)
+    values["uuid"] = uuid4()
+    values["user_id"] = user_id
+    values["poll_url"] = f"/poll/{values['uuid']}" if poll.poll_status == schemas.StatusPoll.PUBLISHED else None
+    return values
+
+
+def write_poll_chunk(db: Session, user_id: int, polls: List[schemas.CreatePoll]) -> List[int]:
+    """
+    Запись пачки опросов тремя запросами без фиксации транзакции
+
+    Опросы, все их вопросы и все варианты ответа вставляются по одному
+    INSERT ... RETURNING на таблицу.
+
+    :param db: сессия БД
+    :param user_id: id владельца опросов
+    :param polls: опросы с вопросами и вариантами ответа
+    :return: id созданных опросов в порядке polls
+    """
+    poll_ids = db.scalars(
+        insert(models.Poll).returning(models.Poll.id, sort_by_parameter_order=True),
+        [_poll_values(poll, user_id) for poll in polls]
+    ).all()
+    questions = [
+        ({**values, "poll_id": poll_id}, choices)
+        for poll_id, poll in zip(poll_ids, polls)
+        for values, choices in question_rows(poll.question or [])
+    ]
+    insert_question_rows(db, questions)
+    return list(poll_ids)
+
+
+def _schedule_polls(db: Session, poll_ids: List[int]) -> None:
+    """ Планирование публикации и завершения импортированных опросов с датами"""
+    scheduled = db.query(models.Poll) \
+        .filter(models.Poll.id.in_(poll_ids)) \
+        .filter((models.Poll.active_from.isnot(None)) | (models.Poll.active_duration.isnot(None))) \
+        .all()
+    for db_poll in scheduled:
+        deadline_scheduler.schedule_poll(db_poll)
+
+
+def _flush_chunk(db: Session, user_id: int, chunk: List[Tuple[schemas.PollImportItem, schemas.CreatePoll]],
+                 report: schemas.PollImportReport) -> None:
+    """
+    Запись пачки опросов в отдельной транзакции
+
+    Если пачка не записалась, ее опросы записываются по одному, чтобы ошибка
+    одного документа не отменила остальные.
+    """
+    try:
+        poll_ids = write_poll_chunk(db, user_id, [poll for _, poll in chunk])
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        if len(chunk) > 1:
+            logger.warning(f"Poll import chunk of {len(chunk)} polls failed, retrying one by one: {e}")
+            for entry in chunk:
+                _flush_chunk(db, user_id, [entry], report)
+            return
+        item, _ = chunk[0]
+        item.status = IMPORT_FAILED
+        item.errors = [str(getattr(e, "orig", None) or e).strip()]
+        report.failed += 1
+        return
+    for (item, _), poll_id in zip(chunk, poll_ids):
+        item.status = IMPORT_CREATED
+        item.poll_id = poll_id
+    report.created += len(poll_ids)
+    _schedule_polls(db, poll_ids)
+
+
+def import_polls(db: Session, stream: BinaryIO, user_id: int) -> schemas.PollImportReport:
+    """
+    Массовый импорт опросов пользователя из NDJSON или ZIP архива документов CreatePoll
+
+    Документы читаются и проверяются по одному, валидные опросы записываются пачками
+    по POLL_IMPORT_CHUNK_SIZE, каждая пачка - отдельная транзакция. В памяти одновременно
+    находится не больше одной пачки опросов.
+
+    :param db: сессия БД
+    :param stream: бинарный поток загруженного файла
+    :param user_id: id владельца опросов
+    :return: отчет с результатом по каждому документу
+    """
+    max_bytes = config.POLL_IMPORT_MAX_DOCUMENT_BYTES
+    report = schemas.PollImportReport()
+    chunk: List[Tuple[schemas.PollImportItem, schemas.CreatePoll]] = []
+    try:
+        for source, document in iter_import_documents(stream, max_bytes):
+            report.total += 1
+            item = schemas.PollImportItem(item=report.total, source=source, status=IMPORT_PENDING)
+            report.items.append(item)
+            poll, errors = _validate(document, max_bytes)
+            if poll is None:
+                item.status = IMPORT_INVALID
+                item.errors = errors
+                report.failed += 1
+                continue
+            item.title = poll.title
+            chunk.append((item, poll))
+            if len(chunk) >= config.POLL_IMPORT_CHUNK_SIZE:
+                _flush_chunk(db, user_id, chunk, report)
+                chunk = []
+    except zipfile.BadZipFile as e:
+        report.total += 1
+        report.failed += 1
+        report.items.append(schemas.PollImportItem(item=report.total, source="archive", status=IMPORT_FAILED,
+                                                   errors=[f"Broken ZIP archive: {e}"]))
+    if chunk:
+        _flush_chunk(db, user_id, chunk, report)
+    logger.info(f"Poll import of user {user_id}: {report.created} of {report.total} polls created")
+    return report
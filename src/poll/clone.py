@@ -0,0 +1,70 @@
+from typing import List, Tuple
+from uuid import uuid4
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from core import config
+
+# Копирование опросов с вопросами и вариантами ответа одним запросом.
+# id новых опросов и вопросов выделяются из последовательностей заранее (nextval в CTE),
+# поэтому соответствие старых и новых id остается в Postgres и не возвращается в приложение.
+CLONE_POLLS_SQL = text("""
+    WITH target AS (
+        SELECT source.ord, source.poll_id AS source_id, source.user_id, source.uuid,
+               nextval(pg_get_serial_sequence('poll', 'id')) AS id
+        FROM unnest(CAST(:source_ids AS integer[]), CAST(:user_ids AS integer[]), CAST(:uuids AS uuid[]))
+            WITH ORDINALITY AS source(poll_id, user_id, uuid, ord)
+    ),
+    question_map AS (
+        SELECT question.id AS source_id, target.id AS poll_id,
+               nextval(pg_get_serial_sequence('question', 'id')) AS id
+        FROM target
+        JOIN question ON question.poll_id = target.source_id
+    ),
+    new_poll AS (
+        INSERT INTO poll (id, uuid, created_at, title, description, poll_cover, poll_status, poll_url,
+                          user_id, active_duration, max_participants, response_storage)
+        SELECT target.id, target.uuid, now(), poll.title, poll.description, poll.poll_cover, 'DRAFT', '',
+               target.user_id, poll.active_duration, poll.max_participants, :response_storage
+        FROM target
+        JOIN poll ON poll.id = target.source_id
+    ),
+    new_question AS (
+        INSERT INTO question (id, type, text, question_cover, option_pass, option_other_answer, poll_id, "order")
+        SELECT question_map.id, question.type, question.text, question.question_cover, question.option_pass,
+               question.option_other_answer, question_map.poll_id, question."order"
+        FROM question_map
+        JOIN question ON question.id = question_map.source_id
+    ),
+    new_choice AS (
+        INSERT INTO choice (text, choice_cover, text_fields_count, question_id)
+        SELECT choice.text, choice.choice_cover, choice.text_fields_count, question_map.id
+        FROM question_map
+        JOIN choice ON choice.question_id = question_map.source_id
+        ORDER BY question_map.id, choice.id
+    )
+    SELECT target.id FROM target ORDER BY target.ord
+""")
+
+
+def clone_polls(db: Session, clones: List[Tuple[int, int]]) -> List[int]:
+    """
+    Копирование опросов с вопросами и вариантами ответа через INSERT ... SELECT без фиксации транзакции
+
+    Копия создается черновиком без ссылки и даты публикации, остальные поля опроса,
+    вопросов и вариантов ответа копируются полностью. Один исходный опрос можно
+    скопировать сразу нескольким пользователям.
+
+    :param db: сессия БД
+    :param clones: пары (id исходного опроса, id владельца копии)
+    :return: id новых опросов в порядке clones
+    """
+    if not clones:
+        return []
+    return db.execute(CLONE_POLLS_SQL, {
+        "source_ids": [poll_id for poll_id, _ in clones],
+        "user_ids": [user_id for _, user_id in clones],
+        "uuids": [str(uuid4()) for _ in clones],
+        "response_storage": config.RESPONSE_STORAGE_MODE,
+    }).scalars().all()
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from core import config
+from api.utils.logger import PollLogger
+from user.models import User
+from . import models
+from .models import PollStatus
+from .answers import iter_answer_batches
+from .snapshot import get_or_create_results_snapshot
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow есть в зависимостях, но окружение может быть собрано без него
+    pa = None
+    pq = None
+
+# Logging
+logger = PollLogger(__name__)
+
+
+class ColumnarExportUnavailable(RuntimeError):
+    """ pyarrow не установлен - выгрузка в Parquet недоступна"""
+
+
+def response_arrow_schema():
+    """ Типизированная схема выгрузки ответов"""
+    return pa.schema([
+        ("response_id", pa.int64()),
+        ("poll_id", pa.int32()),
+        ("question_id", pa.int32()),
+        ("choice_ids", pa.list_(pa.int32())),
+        ("answer_text", pa.string()),
+        ("user_token", pa.string()),
+        ("created_at", pa.timestamp("us")),
+    ])
+
+
+def _choice_ids(answer_choice) -> Optional[List[int]]:
+    if not isinstance(answer_choice, list):
+        return None
+    choice_ids = []
+    for choice_id in answer_choice:
+        try:
+            choice_ids.append(int(choice_id))
+        except (TypeError, ValueError):
+            continue
+    return choice_ids
+
+
+def _answer_text(answer_text) -> Optional[str]:
+    if answer_text is None:
+        return None
+    if isinstance(answer_text, list):
+        return "\n".join(str(text) for text in answer_text)
+    return str(answer_text)
+
+
+def iter_response_columns(db: Session, poll_ids: List[int], batch_size: int) -> Iterator[Dict[str, list]]:
+    """
+    Ответы опросов пачками в виде колонок
+
+    Пачки читаются по ключу id строки хранения, каждая пачка - отдельный запрос с LIMIT.
+
+    :param db: сессия БД
+    :param poll_ids: id опросов
+    :param batch_size: размер пачки
+    :return: словари колонка -> список значений
+    """
+    for rows in iter_answer_batches(db, poll_ids, batch_size):
+        yield {
+            "response_id": [row.answer_id for row in rows],
+            "poll_id": [row.poll_id for row in rows],
+            "question_id": [row.question_id for row in rows],
+            "choice_ids": [_choice_ids(row.answer_choice) for row in rows],
+            "answer_text": [_answer_text(row.answer_text) for row in rows],
+            "user_token": [row.user_token for row in rows],
+            "created_at": [row.created_at for row in rows],
+        }
+
+
+def write_responses_parquet(db: Session, poll_ids: List[int], path: str, batch_size: int) -> None:
+    """
+    Запись ответов опросов в Parquet файл
+
+    Файл пишется во временный и атомарно переименовывается, поэтому параллельные
+    загрузки не увидят недописанный файл.
+
+    :param db: сессия БД
+    :param poll_ids: id опросов
+    :param path: путь к файлу
+    :param batch_size: размер пачки чтения и группы строк
+    """
+    schema = response_arrow_schema()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            for columns in iter_response_columns(db, poll_ids, batch_size):
+                writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema))
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _remove_stale_exports(prefix: str, keep: str) -> None:
+    """ Удаление файлов прежних версий снимков того же опроса или компании"""
+    for name in os.listdir(config.EXPORT_CACHE_DIR):
+        if name.startswith(prefix) and name.endswith(".parquet") and name != keep:
+            try:
+                os.remove(os.path.join(config.EXPORT_CACHE_DIR, name))
+            except OSError:
+                pass
+
+
+def _cached_parquet(db: Session, prefix: str, version: str, poll_ids: List[int]) -> str:
+    """
+    Путь к Parquet файлу из дискового кэша, файл создается при первом обращении
+
+    :param db: сессия БД
+    :param prefix: префикс имени файла - опрос или компания
+    :param version: версия данных - версии снимков результатов
+    :param poll_ids: id опросов
+    :return: путь к файлу
+    """
+    if pa is None:
+        raise ColumnarExportUnavailable("Parquet export requires pyarrow")
+    os.makedirs(config.EXPORT_CACHE_DIR, exist_ok=True)
+    name = f"{prefix}{version}.parquet"
+    path = os.path.join(config.EXPORT_CACHE_DIR, name)
+    if not os.path.exists(path):
+        write_responses_parquet(db, poll_ids, path, config.EXPORT_BATCH_SIZE)
+        _remove_stale_exports(prefix, name)
+        logger.info(f"Parquet export {name} created")
+    return path
+
+
+def get_poll_parquet(db: Session, poll_id: int) -> str:
+    """
+    Parquet файл ответов завершенного опроса, кэш по id опроса и версии снимка результатов
+
+    :param db: сессия БД
+    :param poll_id: id завершенного опроса
+    :return: путь к файлу
+    """
+    db_snapshot = get_or_create_results_snapshot(db, poll_id)
+    return _cached_parquet(db, f"poll_{poll_id}_v", str(db_snapshot.id), [poll_id])
+
+
+def get_company_parquet(db: Session, company_id: int) -> Tuple[Optional[str], int]:
+    """
+    Parquet файл ответов всех завершенных опросов компании
+
+    Версия файла - хэш пар (id опроса, версия снимка), поэтому файл пересоздается,
+    когда завершается новый опрос или сбрасывается снимок одного из опросов.
+
+    :param db: сессия БД
+    :param company_id: id компании
+    :return: путь к файлу и количество опросов, путь None если завершенных опросов нет
+    """
+    poll_ids = [poll_id for poll_id, in db.query(models.Poll.id)
+                .join(User, User.id == models.Poll.user_id)
+                .filter(User.company_id == company_id)
+                .filter(models.Poll.poll_status == PollStatus.ENDED)
+                .order_by(models.Poll.id)
+                .all()]
+    if not poll_ids:
+        return None, 0
+    snapshot_ids = dict(
+        db.query(models.PollResultsSnapshot.poll_id, models.PollResultsSnapshot.id)
+        .filter(models.PollResultsSnapshot.poll_id.in_(poll_ids))
+        .all()
+    )
+    versions = [
+        (poll_id, snapshot_ids[poll_id] if poll_id in snapshot_ids else get_or_create_results_snapshot(db, poll_id).id)
+        for poll_id in poll_ids
+    ]
+    version = hashlib.sha1(repr(versions).encode("utf-8")).hexdigest()[:16]
+    return _cached_parquet(db, f"company_{company_id}_", version, poll_ids), len(poll_ids)
@@ -0,0 +1,238 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from core import config
+from api.utils.logger import PollLogger
+from . import models, schemas
+from .answers import iter_answers_by_respondent
+from .snapshot import get_or_create_results_snapshot
+from .stats import CHOICE_QUESTION_TYPES
+
+# Logging
+logger = PollLogger(__name__)
+
+
+@dataclass
+class ResultsMatrix:
+    """
+    Колоночная модель результатов опроса: участник x вариант ответа
+
+    Каждому участнику присвоен номер бита, каждому варианту ответа - битовая маска
+    выбравших его участников (int произвольной длины). Фильтр сегмента - это
+    побитовое И/ИЛИ масок, подсчет - int.bit_count(), поэтому запросы не проходят
+    по строкам ответов.
+
+    Параметры
+    _____
+
+    poll_id:
+        id опроса
+    version:
+        Версия снимка результатов, по которой построена матрица
+    respondents:
+        Количество участников
+    choice_masks:
+        Маска выбравших по id варианта ответа
+    question_masks:
+        Маска ответивших по id вопроса
+    question_choices:
+        id вариантов ответа вопроса в порядке id
+    choice_texts:
+        Тексты вариантов ответа
+    """
+    poll_id: int
+    version: int
+    respondents: int = 0
+    choice_masks: Dict[int, int] = field(default_factory=dict)
+    question_masks: Dict[int, int] = field(default_factory=dict)
+    question_choices: Dict[int, List[int]] = field(default_factory=dict)
+    choice_texts: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def all_mask(self) -> int:
+        return (1 << self.respondents) - 1
+
+    def filter_mask(self, question_id: int, choice_ids: List[int]) -> int:
+        """ Участники, выбравшие в вопросе хотя бы один из вариантов"""
+        question_choices = self.question_choices.get(question_id, [])
+        mask = 0
+        for choice_id in choice_ids:
+            if choice_id in question_choices:
+                mask |= self.choice_masks.get(choice_id, 0)
+        return mask
+
+    def breakdown(self, question_id: int, mask: int) -> List[dict]:
+        """ Распределение ответов на вопрос внутри сегмента mask"""
+        answered = (self.question_masks.get(question_id, 0) & mask).bit_count()
+        items = []
+        for choice_id in self.question_choices.get(question_id, []):
+            count = (self.choice_masks.get(choice_id, 0) & mask).bit_count()
+            items.append({
+                "choiceId": choice_id,
+                "text": self.choice_texts.get(choice_id, ""),
+                "count": count,
+                "share": round(count / answered, 4) if answered else 0.0
+            })
+        return items
+
+
+def load_results_matrix(db: Session, poll_id: int, version: int, batch_size: int) -> ResultsMatrix:
+    """
+    Построение матрицы результатов из ответов опроса в любом формате хранения
+
+    Ответы читаются серверным курсором пачками по batch_size.
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param version: версия снимка результатов
+    :param batch_size: размер пачки курсора
+    :return: ResultsMatrix
+    """
+    matrix = ResultsMatrix(poll_id=poll_id, version=version)
+    choices = db.query(models.Choice.id, models.Choice.text, models.Choice.question_id) \
+        .join(models.Question, models.Question.id == models.Choice.question_id) \
+        .filter(models.Question.poll_id == poll_id) \
+        .filter(models.Question.type.in_(CHOICE_QUESTION_TYPES)) \
+        .order_by(models.Choice.question_id, models.Choice.id) \
+        .all()
+    choice_questions = {}
+    for choice_id, text, question_id in choices:
+        matrix.question_choices.setdefault(question_id, []).append(choice_id)
+        matrix.choice_texts[choice_id] = text or ""
+        choice_questions[choice_id] = question_id
+
+    # Маски собираются из списков номеров участников и превращаются в int один раз в конце
+    respondent_index: Dict[str, int] = {}
+    choice_bits: Dict[int, List[int]] = {}
+    question_bits: Dict[int, List[int]] = {}
+    for row in iter_answers_by_respondent(db, poll_id, batch_size):
+        user_token, question_id, answer_choice = row.user_token, row.question_id, row.answer_choice
+        if question_id not in matrix.question_choices or not isinstance(answer_choice, list):
+            continue
+        bit = respondent_index.setdefault(user_token, len(respondent_index))
+        question_bits.setdefault(question_id, []).append(bit)
+        for choice_id in answer_choice:
+            try:
+                choice_id = int(choice_id)
+            except (TypeError, ValueError):
+                continue
+            if choice_questions.get(choice_id) == question_id:
+                choice_bits.setdefault(choice_id, []).append(bit)
+
+    size = matrix.respondents = len(respondent_index)
+    matrix.choice_masks = {choice_id: _to_mask(bits, size) for choice_id, bits in choice_bits.items()}
+    matrix.question_masks = {question_id: _to_mask(bits, size) for question_id, bits in question_bits.items()}
+    return matrix
+
+
+def _to_mask(bits: List[int], size: int) -> int:
+    """ Битовая маска из номеров участников через bytearray - линейно по количеству участников"""
+    buffer = bytearray((size + 7) // 8)
+    for bit in bits:
+        buffer[bit >> 3] |= 1 << (bit & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class ResultsMatrixCache:
+    """
+    Ограниченный LRU кэш матриц результатов по id опроса
+
+    Матрица считается актуальной, пока совпадает версия снимка результатов опроса.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[int, ResultsMatrix]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, poll_id: int, version: int) -> Optional[ResultsMatrix]:
+        with self._lock:
+            matrix = self._items.get(poll_id)
+            if matrix is None or matrix.version != version:
+                return None
+            self._items.move_to_end(poll_id)
+            return matrix
+
+    def put(self, matrix: ResultsMatrix) -> None:
+        with self._lock:
+            self._items[matrix.poll_id] = matrix
+            self._items.move_to_end(matrix.poll_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, poll_id: int) -> None:
+        with self._lock:
+            self._items.pop(poll_id, None)
+
+
+results_matrix_cache = ResultsMatrixCache(maxsize=config.RESULTS_MATRIX_CACHE_SIZE)
+
+
+def get_results_matrix(db: Session, poll_id: int) -> ResultsMatrix:
+    """
+    Матрица результатов завершенного опроса из кэша, при промахе - загрузка из БД
+
+    :param db: сессия БД
+    :param poll_id: id завершенного опроса
+    :return: ResultsMatrix
+    """
+    version = get_or_create_results_snapshot(db, poll_id).id
+    matrix = results_matrix_cache.get(poll_id, version)
+    if matrix is None:
+        matrix = load_results_matrix(db, poll_id, version, config.EXPORT_BATCH_SIZE)
+        results_matrix_cache.put(matrix)
+        logger.info(f"Results matrix of poll {poll_id} loaded: {matrix.respondents} respondents")
+    return matrix
+
+
+def build_crosstab(db: Session, poll_id: int, request: schemas.CrossTabRequest) -> dict:
+    """
+    Кросс-таблица: распределение ответов на вопрос в сегменте участников
+
+    Сегмент - участники, удовлетворяющие всем фильтрам. Если указан segment_question_id,
+    распределение считается отдельно для каждого варианта ответа этого вопроса.
+
+    :param db: сессия БД
+    :param poll_id: id завершенного опроса
+    :param request: схема запроса кросс-таблицы
+    :return: словарь CrossTabResponse
+    """
+    matrix = get_results_matrix(db, poll_id)
+    for question_id in [request.breakdown_question_id, request.segment_question_id] + \
+                       [item.question_id for item in request.filters]:
+        if question_id is not None and question_id not in matrix.question_choices:
+            raise HTTPException(status_code=400, detail=f"Question {question_id} has no choices in this poll")
+
+    mask = matrix.all_mask
+    for item in request.filters:
+        mask &= matrix.filter_mask(item.question_id, item.choice_ids)
+
+    if request.segment_question_id is None:
+        segments = [{
+            "choiceId": None,
+            "text": None,
+            "respondents": mask.bit_count(),
+            "items": matrix.breakdown(request.breakdown_question_id, mask)
+        }]
+    else:
+        segments = []
+        for choice_id in matrix.question_choices[request.segment_question_id]:
+            segment_mask = mask & matrix.choice_masks.get(choice_id, 0)
+            segments.append({
+                "choiceId": choice_id,
+                "text": matrix.choice_texts.get(choice_id, ""),
+                "respondents": segment_mask.bit_count(),
+                "items": matrix.breakdown(request.breakdown_question_id, segment_mask)
+            })
+
+    return {
+        "totalRespondents": matrix.respondents,
+        "matchedRespondents": mask.bit_count(),
+        "breakdownQuestionId": request.breakdown_question_id,
+        "segments": segments
+    }
@@ -0,0 +1,187 @@
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .models import TypeQuestion
+
+# Поля, по которым сравниваются сохраненные и присланные вопросы и варианты ответа
+QUESTION_FIELDS = ("type", "text", "question_cover", "option_pass", "option_other_answer", "order")
+CHOICE_FIELDS = ("text", "choice_cover")
+
+
+def _question_values(question: schemas.Question, order: int) -> dict:
+    """ Значения колонок вопроса, order - позиция вопроса в присланном списке"""
+    return {
+        "type": TypeQuestion(question.type.value),
+        "text": question.text,
+        "question_cover": question.question_cover,
+        "option_pass": question.option_pass,
+        "option_other_answer": question.option_other_answer,
+        "order": order,
+    }
+
+
+def _choice_values(choice: schemas.Choice) -> dict:
+    return {"text": choice.text, "choice_cover": choice.choice_cover}
+
+
+def _changed(row, values: dict, fields: Tuple[str, ...]) -> bool:
+    return any(getattr(row, field) != values[field] for field in fields)
+
+
+def load_poll_tree_rows(db: Session, poll_id: int) -> Tuple[Dict[int, tuple], Dict[int, Dict[int, tuple]]]:
+    """
+    Сохраненные вопросы и варианты ответа опроса строками без загрузки моделей
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: вопросы по id и варианты ответа по id вопроса и id варианта
+    """
+    questions = {
+        row.id: row for row in db.execute(
+            select(models.Question.id, *[getattr(models.Question, field) for field in QUESTION_FIELDS])
+            .where(models.Question.poll_id == poll_id)
+        )
+    }
+    choices: Dict[int, Dict[int, tuple]] = {}
+    if questions:
+        for row in db.execute(
+                select(models.Choice.id, models.Choice.question_id,
+                       *[getattr(models.Choice, field) for field in CHOICE_FIELDS])
+                .where(models.Choice.question_id.in_(list(questions)))
+        ):
+            choices.setdefault(row.question_id, {})[row.id] = row
+    return questions, choices
+
+
+def apply_poll_questions(db: Session, poll_id: int, questions: List[schemas.Question],
+                         changeset: schemas.PollChangeset) -> schemas.PollChangeset:
+    """
+    Применение присланного списка вопросов к опросу минимальным набором изменений без фиксации транзакции
+
+    Вопросы сопоставляются по id среди вопросов опроса, варианты ответа - по id среди
+    вариантов того же вопроса. Неизмененные строки не трогаются, измененные обновляются
+    одним UPDATE по первичному ключу на таблицу, новые вставляются одним INSERT ... RETURNING,
+    отсутствующие в списке удаляются. Элементы без id, с чужим или повторным id считаются новыми.
+    Порядок вопросов сохраняется в Question.order.
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param questions: присланные вопросы с вариантами ответа
+    :param changeset: набор изменений, дополняется id затронутых строк
+    :return: набор изменений
+    """
+    db_questions, db_choices = load_poll_tree_rows(db, poll_id)
+
+    question_updates = []
+    choice_updates = []
+    new_questions: List[Tuple[dict, List[schemas.Choice]]] = []
+    new_choices = []
+    deleted_choice_ids = []
+    kept_question_ids = set()
+
+    for order, question in enumerate(questions):
+        values = _question_values(question, order)
+        db_question = db_questions.get(question.id)
+        if db_question is None or db_question.id in kept_question_ids:
+            new_questions.append((values, question.choice or []))
+            continue
+        kept_question_ids.add(db_question.id)
+        if _changed(db_question, values, QUESTION_FIELDS):
+            question_updates.append({"id": db_question.id, **values})
+            changeset.questions_updated.append(db_question.id)
+
+        question_choices = db_choices.get(db_question.id, {})
+        kept_choice_ids = set()
+        for choice in question.choice or []:
+            choice_values = _choice_values(choice)
+            db_choice = question_choices.get(choice.id)
+            if db_choice is None or db_choice.id in kept_choice_ids:
+                new_choices.append({**choice_values, "question_id": db_question.id})
+                continue
+            kept_choice_ids.add(db_choice.id)
+            if _changed(db_choice, choice_values, CHOICE_FIELDS):
+                choice_updates.append({"id": db_choice.id, **choice_values})
+                changeset.choices_updated.append(db_choice.id)
+        deleted_choice_ids.extend(choice_id for choice_id in question_choices if choice_id not in kept_choice_ids)
+
+    deleted_question_ids = [question_id for question_id in db_questions if question_id not in kept_question_ids]
+
+    # Удаление: варианты удаленных вопросов вместе с удаленными вариантами оставшихся
+    if deleted_choice_ids or deleted_question_ids:
+        changeset.choices_deleted.extend(db.scalars(
+            delete(models.Choice)
+            .where(or_(models.Choice.id.in_(deleted_choice_ids),
+                       models.Choice.question_id.in_(deleted_question_ids)))
+            .returning(models.Choice.id),
+            execution_options={"synchronize_session": False}
+        ).all())
+    if deleted_question_ids:
+        db.execute(delete(models.Question).where(models.Question.id.in_(deleted_question_ids)),
+                   execution_options={"synchronize_session": False})
+        changeset.questions_deleted.extend(deleted_question_ids)
+
+    # Обновление по первичному ключу - executemany одним запросом на таблицу
+    if question_updates:
+        db.execute(update(models.Question), question_updates)
+    if choice_updates:
+        db.execute(update(models.Choice), choice_updates)
+
+    # Вставка новых вопросов, затем всех новых вариантов ответа
+    question_ids, choice_ids = insert_questions(db, poll_id, new_questions, new_choices)
+    changeset.questions_inserted.extend(question_ids)
+    changeset.choices_inserted.extend(choice_ids)
+    return changeset
+
+
+def insert_questions(db: Session, poll_id: int, questions: List[Tuple[dict, List[schemas.Choice]]],
+                     choices: Optional[List[dict]] = None) -> Tuple[List[int], List[int]]:
+    """
+    Вставка вопросов с вариантами ответа двумя запросами без фиксации транзакции
+
+    Все вопросы вставляются одним INSERT ... RETURNING id в порядке списка, затем
+    все варианты ответа - одним многострочным INSERT.
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param questions: пары (значения колонок вопроса, варианты ответа)
+    :param choices: варианты ответа уже сохраненных вопросов, вставляются тем же запросом
+    :return: id вставленных вопросов и вариантов ответа
+    """
+    rows = [({**values, "poll_id": poll_id}, question_choices) for values, question_choices in questions]
+    return insert_question_rows(db, rows, choices)
+
+
+def insert_question_rows(db: Session, questions: List[Tuple[dict, List[schemas.Choice]]],
+                         choices: Optional[List[dict]] = None) -> Tuple[List[int], List[int]]:
+    """
+    Вставка вопросов любых опросов двумя запросами, значения колонок вопроса содержат poll_id
+
+    :param db: сессия БД
+    :param questions: пары (значения колонок вопроса, варианты ответа)
+    :param choices: варианты ответа уже сохраненных вопросов
+    :return: id вставленных вопросов и вариантов ответа
+    """
+    new_choices = list(choices or [])
+    question_ids = []
+    if questions:
+        question_ids = db.scalars(
+            insert(models.Question).returning(models.Question.id, sort_by_parameter_order=True),
+            [values for values, _ in questions]
+        ).all()
+        for question_id, (_, question_choices) in zip(question_ids, questions):
+            new_choices.extend({**_choice_values(choice), "question_id": question_id} for choice in question_choices)
+    choice_ids = []
+    if new_choices:
+        choice_ids = db.scalars(
+            insert(models.Choice).returning(models.Choice.id, sort_by_parameter_order=True),
+            new_choices
+        ).all()
+    return list(question_ids), list(choice_ids)
+
+
+def question_rows(questions: List[schemas.Question]) -> List[Tuple[dict, List[schemas.Choice]]]:
+    """ Вопросы схемы в виде пар для insert_questions, порядок - позиция в списке"""
+    return [(_question_values(question, order), question.choice or []) for order, question in enumerate(questions)]
@@ -0,0 +1,212 @@
+import csv
+import io
+import re
+import zipfile
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from sqlalchemy.orm import Session
+
+from db.session import SessionLocal
+from . import models
+from .answers import iter_answers_by_respondent
+from .stats import get_poll_questions
+
+# Разделитель нескольких значений в одной ячейке
+VALUE_SEPARATOR = "; "
+RESPONDENT_COLUMN = "Участник"
+# Управляющие символы, недопустимые в XML листа
+XML_ILLEGAL_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def get_choice_texts(db: Session, poll_id: int) -> Dict[int, str]:
+    """
+    Тексты вариантов ответа опроса по id - один запрос на всю выгрузку
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: словарь id варианта -> текст
+    """
+    return dict(
+        db.query(models.Choice.id, models.Choice.text)
+        .join(models.Question, models.Question.id == models.Choice.question_id)
+        .filter(models.Question.poll_id == poll_id)
+        .all()
+    )
+
+
+def _answer_values(answer_choice, answer_text, choice_texts: Dict[int, str]) -> List[str]:
+    """ Значения одного ответа: тексты выбранных вариантов и текстовые ответы"""
+    values = []
+    if isinstance(answer_choice, list):
+        for choice_id in answer_choice:
+            try:
+                values.append(choice_texts.get(int(choice_id), str(choice_id)))
+            except (TypeError, ValueError):
+                values.append(str(choice_id))
+    if isinstance(answer_text, list):
+        values.extend(str(text) for text in answer_text if text)
+    elif answer_text:
+        values.append(str(answer_text))
+    return values
+
+
+def iter_respondent_rows(db: Session, poll_id: int, batch_size: int) -> Iterator[List[str]]:
+    """
+    Строки выгрузки: заголовок, затем по одной строке на участника (user_token)
+
+    Ответы читаются серверным курсором пачками по batch_size, ответы одного участника
+    идут подряд, поэтому в памяти держится только текущий участник.
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param batch_size: размер пачки курсора
+    :return: строки со значениями ячеек
+    """
+    questions = get_poll_questions(db, poll_id)
+    columns = {question_id: index for index, (question_id, _, _) in enumerate(questions)}
+    choice_texts = get_choice_texts(db, poll_id)
+    yield [RESPONDENT_COLUMN] + [question_text or "" for _, _, question_text in questions]
+
+    current_token: Optional[str] = None
+    cells: List[List[str]] = []
+    for row in iter_answers_by_respondent(db, poll_id, batch_size):
+        user_token, question_id = row.user_token, row.question_id
+        if user_token != current_token:
+            if current_token is not None:
+                yield [current_token] + [VALUE_SEPARATOR.join(values) for values in cells]
+            current_token = user_token
+            cells = [[] for _ in questions]
+        column = columns.get(question_id)
+        if column is not None:
+            cells[column].extend(_answer_values(row.answer_choice, row.answer_text, choice_texts))
+    if current_token is not None:
+        yield [current_token] + [VALUE_SEPARATOR.join(values) for values in cells]
+
+
+def _iter_poll_rows(poll_id: int, batch_size: int) -> Iterator[List[str]]:
+    """ Строки выгрузки в собственной сессии БД - сессия запроса закрывается до конца передачи"""
+    with SessionLocal() as db:
+        yield from iter_respondent_rows(db, poll_id, batch_size)
+
+
+def iter_responses_csv(poll_id: int, batch_size: int) -> Iterator[bytes]:
+    """
+    Потоковая выгрузка ответов в CSV (UTF-8 с BOM для Excel)
+
+    :param poll_id: id опроса
+    :param batch_size: количество строк в одном фрагменте
+    :return: фрагменты CSV файла
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    for index, row in enumerate(_iter_poll_rows(poll_id, batch_size), start=1):
+        writer.writerow(row)
+        if index % batch_size == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkWriter:
+    """ Поток без seek для zipfile - записанные байты забираются генератором после каждой строки"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Responses" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_TAIL = '</sheetData></worksheet>'
+XLSX_STATIC_PARTS: Tuple[Tuple[str, str], ...] = (
+    ("[Content_Types].xml", XLSX_CONTENT_TYPES),
+    ("_rels/.rels", XLSX_ROOT_RELS),
+    ("xl/workbook.xml", XLSX_WORKBOOK),
+    ("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS),
+)
+
+
+def _xlsx_cell(value: str) -> str:
+    # inline строки не требуют таблицы sharedStrings, поэтому строку можно записать сразу
+    value = escape(XML_ILLEGAL_CHARS.sub("", value))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{value}</t></is></c>'
+
+
+def _xlsx_row(row: List[str]) -> str:
+    return "<row>" + "".join(_xlsx_cell(value) for value in row) + "</row>"
+
+
+def iter_responses_xlsx(poll_id: int, batch_size: int) -> Iterator[bytes]:
+    """
+    Потоковая выгрузка ответов в XLSX
+
+    Лист пишется построчно прямо в zip архив без seek, поэтому память не зависит
+    от количества участников.
+
+    :param poll_id: id опроса
+    :param batch_size: количество строк в одном фрагменте
+    :return: фрагменты XLSX файла
+    """
+    stream = _ChunkWriter()
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS:
+            archive.writestr(name, content)
+        yield stream.drain()
+        with archive.open("xl/worksheets/sheet1.xml", mode="w") as sheet:
+            sheet.write(XLSX_SHEET_HEAD.encode("utf-8"))
+            for index, row in enumerate(_iter_poll_rows(poll_id, batch_size), start=1):
+                sheet.write(_xlsx_row(row).encode("utf-8"))
+                if index % batch_size == 0:
+                    yield stream.drain()
+            sheet.write(XLSX_SHEET_TAIL.encode("utf-8"))
+    yield stream.drain()
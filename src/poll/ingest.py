@@ -0,0 +1,325 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import threading
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from core import config
+from db.session import SessionLocal, engine
+from api.utils.logger import PollLogger
+from .models import ResponseStorage
+from .submission import insert_response_rows, insert_submission_rows, build_response_choice_rows
+from .tally import increment_choice_tally, count_selected_choices, response_choice_pairs
+from .snapshot import delete_results_snapshots
+
+# Logging
+logger = PollLogger(__name__)
+
+RESPONSE_COPY_COLUMNS = ("id", "poll_id", "question_id", "answer_text", "answer_choice", "user_token", "created_at")
+RESPONSE_COPY_SQL = f"COPY response ({', '.join(RESPONSE_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+RESPONSE_CHOICE_COPY_COLUMNS = ("response_id", "question_id", "choice_id")
+RESPONSE_CHOICE_COPY_SQL = f"COPY response_choice ({', '.join(RESPONSE_CHOICE_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+# id ответов выделяются из последовательности заранее - COPY не возвращает id
+RESPONSE_IDS_SQL = "SELECT nextval(pg_get_serial_sequence('response', 'id')) FROM generate_series(1, %s)"
+
+
+def _copy_value(column: str, value):
+    """ Значение для CSV потока COPY: JSON колонки сериализуются, None дает NULL"""
+    if value is None:
+        return None
+    if column in ("answer_text", "answer_choice"):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv_buffer(rows: List[dict], columns) -> io.StringIO:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(column, row.get(column)) for column in columns])
+    buffer.seek(0)
+    return buffer
+
+
+def copy_response_rows(rows: List[dict]) -> None:
+    """
+    Запись пачки ответов и выбранных вариантов через COPY FROM STDIN одной транзакцией
+
+    Счетчики choice_tally увеличиваются в той же транзакции.
+
+    :param rows: строки ответов
+    """
+    with engine.begin() as connection:
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute(RESPONSE_IDS_SQL, (len(rows),))
+            response_ids = [response_id for response_id, in cursor.fetchall()]
+            rows = [dict(row, id=response_id) for response_id, row in zip(response_ids, rows)]
+            cursor.copy_expert(RESPONSE_COPY_SQL, _csv_buffer(rows, RESPONSE_COPY_COLUMNS))
+            choice_rows = build_response_choice_rows(response_ids, rows)
+            if choice_rows:
+                cursor.copy_expert(RESPONSE_CHOICE_COPY_SQL, _csv_buffer(choice_rows, RESPONSE_CHOICE_COPY_COLUMNS))
+        finally:
+            cursor.close()
+        increment_choice_tally(connection, {row["poll_id"] for row in rows},
+                               count_selected_choices(response_choice_pairs(rows)))
+
+
+def write_response_rows(rows: List[dict]) -> None:
+    """
+    Запись пачки ответов: COPY, при ошибке - многострочный INSERT
+
+    :param rows: строки ответов
+    """
+    try:
+        copy_response_rows(rows)
+    except Exception as e:
+        logger.error(f"COPY of {len(rows)} responses failed, falling back to INSERT: {e}")
+        with SessionLocal() as db:
+            insert_response_rows(db, rows)
+            db.commit()
+
+
+def write_submission_rows(rows: List[dict]) -> None:
+    """
+    Запись пачки анкет респондентов многострочным INSERT
+
+    :param rows: строки таблицы submission
+    """
+    with SessionLocal() as db:
+        insert_submission_rows(db, rows)
+        db.commit()
+
+
+def drop_ended_snapshots(rows: List[dict]) -> None:
+    """ Сброс снимков результатов опросов, ответы которых дописаны из буфера"""
+    with SessionLocal() as db:
+        delete_results_snapshots(db, {row["poll_id"] for row in rows})
+        db.commit()
+
+
+def write_storage_rows(storage: str, rows: List[dict]) -> None:
+    """
+    Запись пачки строк в таблицу формата хранения
+
+    Если опрос успел завершиться пока ответы ждали в буфере, его снимок
+    результатов сбрасывается и будет пересчитан при следующем чтении. Ошибка
+    сброса снимка не считается ошибкой записи - ответы уже зафиксированы.
+
+    :param storage: формат хранения ответов
+    :param rows: строки ответов или анкет
+    """
+    if storage == ResponseStorage.SUBMISSION:
+        write_submission_rows(rows)
+    else:
+        write_response_rows(rows)
+    try:
+        drop_ended_snapshots(rows)
+    except Exception as e:
+        logger.error(f"Failed to drop results snapshots after buffered write: {e}")
+
+
+_dead_letter_lock = threading.Lock()
+
+
+def write_dead_letter(storage: str, rows: List[dict], error: Exception) -> None:
+    """
+    Сохранение ответов, которые не удалось записать в БД, в файл недоставленных (NDJSON)
+
+    Ответы уже подтверждены клиенту, поэтому не отбрасываются, а дописываются
+    в файл RESPONSE_INGEST_DEAD_LETTER_PATH для ручного разбора и повторной загрузки.
+
+    :param storage: формат хранения ответов
+    :param rows: строки ответов одного респондента
+    :param error: ошибка записи
+    """
+    record = {
+        "failed_at": datetime.utcnow().isoformat(),
+        "storage": storage,
+        "error": str(error),
+        "rows": rows,
+    }
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    path = config.RESPONSE_INGEST_DEAD_LETTER_PATH
+    with _dead_letter_lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as dead_letter:
+            dead_letter.write(line)
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+
+
+@dataclass
+class ResponseIngestStats:
+    """
+    Метрики буфера отложенной записи ответов
+
+    Параметры
+    _____
+
+    queued:
+        Респондентов в очереди
+    written_respondents:
+        Респондентов, ответы которых записаны в БД
+    failed_batches:
+        Пачек, запись которых целиком завершилась ошибкой и повторялась по респондентам
+    dead_lettered_respondents:
+        Респондентов, ответы которых не записались и сохранены в файл недоставленных
+    lost_respondents:
+        Респондентов, ответы которых не удалось сохранить даже в файл недоставленных
+    """
+    queued: int = 0
+    written_respondents: int = 0
+    failed_batches: int = 0
+    dead_lettered_respondents: int = 0
+    lost_respondents: int = 0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class ResponseIngestBuffer:
+    """
+    Буфер отложенной записи ответов (write-behind)
+
+    Проверенные ответы складываются в ограниченную очередь, фоновая задача
+    сбрасывает их в БД пачками по размеру batch_size или раз в flush_interval секунд.
+    Если очередь заполнена дольше put_timeout секунд, submit возвращает False
+    и вызывающий код пишет ответы синхронно.
+
+    Если пачка не записалась, ответы записываются заново по одному респонденту,
+    чтобы ошибка одного респондента не отменила запись остальных. Не записавшиеся
+    и при повторе ответы сохраняются в файл недоставленных.
+    """
+
+    def __init__(self, max_queue_size: int = 10000, batch_size: int = 1000,
+                 flush_interval: float = 1.0, put_timeout: float = 0.5):
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = ResponseIngestStats()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def stats(self) -> ResponseIngestStats:
+        return ResponseIngestStats(**dict(self._stats.to_dict(), queued=self._queue.qsize() if self._queue else 0))
+
+    async def start(self) -> None:
+        """ Запуск фоновой задачи сброса буфера"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+        logger.info('Response ingest buffer started')
+
+    async def stop(self) -> None:
+        """ Остановка с записью всех накопленных ответов"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        logger.info('Response ingest buffer stopped')
+
+    async def submit(self, rows: List[dict], storage: str = ResponseStorage.RESPONSE.value) -> bool:
+        """
+        Постановка ответов респондента в очередь
+
+        :param rows: строки ответов одного респондента
+        :param storage: формат хранения ответов опроса
+        :return: True если ответы приняты буфером, False если нужна синхронная запись
+        """
+        if not self.running or not rows:
+            return False
+        submitted_at = datetime.utcnow()
+        for row in rows:
+            row.setdefault("created_at", submitted_at)
+        try:
+            await asyncio.wait_for(self._queue.put((storage, rows)), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Response ingest queue is full ({self._queue.qsize()}), writing synchronously")
+            return False
+        return True
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            # Строки копятся отдельно для каждого формата хранения, по списку строк на респондента
+            batch: Dict[str, List[List[dict]]] = {}
+            size = 0
+            item = await self._queue.get()
+            if item is None:
+                stopping = True
+            else:
+                batch.setdefault(item[0], []).append(item[1])
+                size += len(item[1])
+            deadline = loop.time() + self.flush_interval
+            while not stopping and size < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.setdefault(item[0], []).append(item[1])
+                    size += len(item[1])
+            for storage, respondents in batch.items():
+                await asyncio.to_thread(self._flush, storage, respondents)
+
+    def _flush(self, storage: str, respondents: List[List[dict]]) -> None:
+        """
+        Запись пачки ответов, при ошибке - по одному респонденту, затем в файл недоставленных
+
+        :param storage: формат хранения ответов
+        :param respondents: строки ответов каждого респондента
+        """
+        try:
+            write_storage_rows(storage, [row for rows in respondents for row in rows])
+            self._stats.written_respondents += len(respondents)
+            return
+        except Exception as e:
+            self._stats.failed_batches += 1
+            logger.error(f"Failed to flush {len(respondents)} buffered {storage} respondents, "
+                         f"retrying one by one: {e}")
+        for rows in respondents:
+            try:
+                write_storage_rows(storage, rows)
+                self._stats.written_respondents += 1
+                continue
+            except Exception as e:
+                error = e
+            try:
+                write_dead_letter(storage, rows, error)
+                self._stats.dead_lettered_respondents += 1
+                logger.error(f"Buffered {storage} rows of respondent {rows[0].get('user_token')} "
+                             f"moved to dead letter file: {error}")
+            except Exception as e:
+                self._stats.lost_respondents += 1
+                logger.error(f"Failed to save buffered {storage} rows to dead letter file: {e}; "
+                             f"rows: {json.dumps(rows, ensure_ascii=False, default=str)}")
+
+
+response_ingest_buffer = ResponseIngestBuffer(
+    max_queue_size=config.RESPONSE_INGEST_QUEUE_SIZE,
+    batch_size=config.RESPONSE_INGEST_BATCH_SIZE,
+    flush_interval=config.RESPONSE_INGEST_FLUSH_INTERVAL,
+    put_timeout=config.RESPONSE_INGEST_PUT_TIMEOUT,
+)
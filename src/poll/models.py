@@ -1,12 +1,15 @@
 from db.base_class import Base
 from enum import Enum
-from sqlalchemy.dialects.postgresql import ENUM, UUID
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, JSON, event, DateTime
+from sqlalchemy.dialects.postgresql import ENUM, UUID, JSONB
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, BigInteger, String, DateTime, JSON, event, DateTime, LargeBinary, \
+    Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone, timedelta
 import uuid
 from sqlalchemy import func
 
+from core import config
+
 
 class TypeQuestion(str, Enum):
     SINGLE = "SINGLE ANSWER"
@@ -23,6 +26,11 @@ class PollStatus(str, Enum):
     ARCHIVED = "ARCHIVED"
 
 
+class ResponseStorage(str, Enum):
+    RESPONSE = "response"  # one row per answer in table response
+    SUBMISSION = "submission"  # one row per respondent in table submission
+
+
 class Poll(Base):
     """Model poll"""
 
@@ -42,6 +50,8 @@ class Poll(Base):
     active_from = Column(DateTime, nullable=True)
     active_duration = Column(Integer, nullable=True)
     max_participants = Column(Integer, nullable=True)
+    response_storage = Column(String(16), nullable=False, server_default=ResponseStorage.RESPONSE.value,
+                              default=lambda: config.RESPONSE_STORAGE_MODE, comment="Формат хранения ответов")
 
     def is_published(self):
         if self.poll_status == PollStatus.PUBLISHED:
@@ -108,4 +118,57 @@ class Response(Base):
     user_token = Column(String, nullable=False, index=True)
 
 
+# Model submission
+class Submission(Base):
+    """Model submission - all answers of one respondent, answers map question id -> {"choice": [...], "text": ...}"""
+
+    __table_args__ = (
+        Index("ix_submission_poll_id_user_token", "poll_id", "user_token", unique=True),
+        Index("ix_submission_answers", "answers", postgresql_using="gin", postgresql_ops={"answers": "jsonb_path_ops"}),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    poll_id = Column(Integer, ForeignKey("poll.id", ondelete="CASCADE"), nullable=False)
+    user_token = Column(String, nullable=False)
+    answers = Column(JSONB, nullable=False)
+
+
+# Model response choice
+class ResponseChoice(Base):
+    """Model response choice - one row per selected choice of response, replaces JSON array for counting"""
+
+    __tablename__ = "response_choice"
+    __table_args__ = (
+        Index("ix_response_choice_question_id_choice_id", "question_id", "choice_id"),
+        Index("ix_response_choice_choice_id", "choice_id"),
+    )
 
+    response_id = Column(Integer, ForeignKey("response.id", ondelete="CASCADE"), primary_key=True)
+    choice_id = Column(Integer, ForeignKey("choice.id", ondelete="CASCADE"), primary_key=True)
+    question_id = Column(Integer, ForeignKey("question.id", ondelete="CASCADE"), nullable=False)
+
+
+# Model choice tally
+class ChoiceTally(Base):
+    """Model choice tally - live count of choice selections, updated with every submission"""
+
+    __tablename__ = "choice_tally"
+
+    question_id = Column(Integer, ForeignKey("question.id", ondelete="CASCADE"), primary_key=True)
+    choice_id = Column(Integer, ForeignKey("choice.id", ondelete="CASCADE"), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+
+# Model results snapshot
+class PollResultsSnapshot(Base):
+    """Model results snapshot - stats of ended poll compressed once, id is the snapshot version"""
+
+    __tablename__ = "poll_results_snapshot"
+
+    id = Column(Integer, primary_key=True, index=True)
+    poll_id = Column(Integer, ForeignKey("poll.id", ondelete="CASCADE"), unique=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, comment="Дата расчета")
+    response_count = Column(Integer, nullable=False, default=0)
+    respondent_count = Column(Integer, nullable=False, default=0)
+    data = Column(LargeBinary, nullable=False, comment="Статистика в JSON сжатая zlib")
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+import redis
+
+from core import config
+from api.utils.logger import PollLogger
+from .runtime import poll_runtime_cache
+
+# Logging
+logger = PollLogger(__name__)
+
+REDIS_KEY_PREFIX = "poll:published:"
+
+
+class PublishedPollCache:
+    """
+    Кэш готового JSON опубликованного опроса для респондентов
+
+    Два уровня: LRU в памяти процесса с коротким TTL и, если задан REDIS_URL,
+    общий для всех воркеров Redis. При промахе загрузка выполняется одним потоком
+    на ключ (single-flight), остальные запросы того же опроса ждут ее результата.
+
+    Параметры
+    _____
+
+    maxsize:
+        Максимальное количество опросов в памяти процесса
+    local_ttl:
+        Время жизни записи в памяти процесса, сек - ограничивает устаревание
+        после изменения опроса на другом воркере
+    redis_url:
+        Адрес Redis или None
+    redis_ttl:
+        Время жизни записи в Redis, сек
+    """
+
+    def __init__(self, maxsize: int = 512, local_ttl: float = 10.0,
+                 redis_url: Optional[str] = None, redis_ttl: int = 600):
+        self.maxsize = maxsize
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self._items: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._generations: Dict[str, int] = {}
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5) if redis_url else None
+
+    def _get_local(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, payload = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return payload
+
+    def _put_local(self, key: str, payload: bytes) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.local_ttl, payload)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def _get_redis(self, key: str) -> Optional[bytes]:
+        if self._redis is None:
+            return None
+        try:
+            return self._redis.get(REDIS_KEY_PREFIX + key)
+        except redis.RedisError as e:
+            logger.warning(f"Published poll cache: Redis get failed: {e}")
+            return None
+
+    def _put_redis(self, key: str, payload: bytes) -> None:
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(REDIS_KEY_PREFIX + key, payload, ex=self.redis_ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Published poll cache: Redis set failed: {e}")
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            key_lock, waiters = self._loading.get(key, (None, 0))
+            if key_lock is None:
+                key_lock = threading.Lock()
+            self._loading[key] = (key_lock, waiters + 1)
+            return key_lock
+
+    def _release_key(self, key: str) -> None:
+        """
+        Освобождение блокировки ключа: последний ожидавший поток удаляет блокировку и поколение,
+        поэтому словари хранят только ключи, загрузка которых идет прямо сейчас
+        """
+        with self._lock:
+            key_lock, waiters = self._loading[key]
+            if waiters > 1:
+                self._loading[key] = (key_lock, waiters - 1)
+            else:
+                del self._loading[key]
+                self._generations.pop(key, None)
+
+    def get_or_load(self, poll_uuid: UUID, loader: Callable[[], Optional[bytes]]) -> Optional[bytes]:
+        """
+        JSON опроса из кэша, при промахе - загрузка через loader
+
+        :param poll_uuid: UUID опроса
+        :param loader: функция рендера JSON, None - опрос не опубликован и не кэшируется
+        :return: JSON опроса или None
+        """
+        key = str(poll_uuid)
+        payload = self._get_local(key)
+        if payload is not None:
+            return payload
+        key_lock = self._key_lock(key)
+        with key_lock:
+            try:
+                # Пока ждали блокировку, опрос мог загрузить другой поток
+                payload = self._get_local(key)
+                if payload is not None:
+                    return payload
+                generation = self._generation(key)
+                payload = self._get_redis(key)
+                loaded = payload is None
+                if loaded:
+                    payload = loader()
+                    if payload is None:
+                        return None
+                # Опрос изменили во время загрузки - отдаем результат, но не кэшируем его
+                if generation == self._generation(key):
+                    if loaded:
+                        self._put_redis(key, payload)
+                    self._put_local(key, payload)
+                return payload
+            finally:
+                self._release_key(key)
+
+    def _generation(self, key: str) -> int:
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def invalidate(self, poll_uuid: UUID) -> None:
+        key = str(poll_uuid)
+        with self._lock:
+            self._items.pop(key, None)
+            # Поколение нужно только загрузке, идущей в этот момент
+            if key in self._loading:
+                self._generations[key] = self._generations.get(key, 0) + 1
+        if self._redis is not None:
+            try:
+                self._redis.delete(REDIS_KEY_PREFIX + key)
+            except redis.RedisError as e:
+                logger.warning(f"Published poll cache: Redis delete failed: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+published_poll_cache = PublishedPollCache(
+    maxsize=config.PUBLISHED_POLL_CACHE_SIZE,
+    local_ttl=config.PUBLISHED_POLL_LOCAL_TTL_SECONDS,
+    redis_url=config.REDIS_URL if config.PUBLISHED_POLL_CACHE_REDIS else None,
+    redis_ttl=config.PUBLISHED_POLL_CACHE_TTL_SECONDS,
+)
+
+
+def invalidate_poll_caches(poll_uuid: UUID) -> None:
+    """ Сброс всех кэшей опроса после его изменения"""
+    poll_runtime_cache.invalidate(poll_uuid)
+    published_poll_cache.invalidate(poll_uuid)
@@ -0,0 +1,31 @@
+from typing import Optional
+
+from sqlalchemy import exists, func
+from sqlalchemy.orm import Session
+
+from . import models
+
+NO_QUESTIONS_ERROR = "At least one question is required to publish the poll"
+QUESTION_WITHOUT_CHOICES_ERROR = "Each question must have at least one choice to publish the poll"
+
+
+def get_publish_error(db: Session, poll_id: int) -> Optional[str]:
+    """
+    Проверка готовности опроса к публикации - общая для ручной и плановой публикации
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: причина отказа или None, если опрос можно публиковать
+    """
+    without_choices = ~exists().where(models.Choice.question_id == models.Question.id)
+    questions, questions_without_choices = db.query(
+        func.count(models.Question.id),
+        func.count(models.Question.id).filter(without_choices)
+    ) \
+        .filter(models.Question.poll_id == poll_id) \
+        .one()
+    if not questions:
+        return NO_QUESTIONS_ERROR
+    if questions_without_choices:
+        return QUESTION_WITHOUT_CHOICES_ERROR
+    return None
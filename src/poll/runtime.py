@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from core import config
+from . import models
+from api.utils.logger import PollLogger
+
+# Logging
+logger = PollLogger(__name__)
+
+
+@dataclass(frozen=True)
+class QuestionRuntime:
+    """
+    Скомпилированное описание вопроса для проверки ответов
+
+    Параметры
+    _____
+
+    id:
+        id вопроса
+    poll_id:
+        id опроса
+    type:
+        Тип вопроса
+    choice_ids:
+        Множество id вариантов ответа вопроса
+    """
+    id: int
+    poll_id: int
+    type: models.TypeQuestion
+    choice_ids: FrozenSet[int] = field(default_factory=frozenset)
+
+
+@dataclass(frozen=True)
+class PollRuntime:
+    """
+    Скомпилированный опрос - все что нужно для проверки ответов без запросов в БД
+
+    Параметры
+    _____
+
+    poll_id:
+        id опроса
+    poll_uuid:
+        UUID опроса
+    questions:
+        Словарь question_id -> QuestionRuntime
+    """
+    poll_id: int
+    poll_uuid: str
+    questions: Dict[int, QuestionRuntime] = field(default_factory=dict)
+
+    def get_question(self, question_id: int) -> Optional[QuestionRuntime]:
+        return self.questions.get(question_id)
+
+
+def compile_poll_runtime(db: Session, db_poll: models.Poll) -> PollRuntime:
+    """
+    Сборка PollRuntime из Poll -> Question -> Choice двумя запросами
+
+    :param db: сессия БД
+    :param db_poll: модель опроса
+    :return: PollRuntime
+    """
+    db_questions = db.query(models.Question).filter(models.Question.poll_id == db_poll.id).all()
+    choice_ids = {db_question.id: set() for db_question in db_questions}
+    if choice_ids:
+        rows = db.query(models.Choice.id, models.Choice.question_id) \
+            .filter(models.Choice.question_id.in_(choice_ids.keys())).all()
+        for choice_id, question_id in rows:
+            choice_ids[question_id].add(choice_id)
+    questions = {
+        db_question.id: QuestionRuntime(
+            id=db_question.id,
+            poll_id=db_poll.id,
+            type=db_question.type,
+            choice_ids=frozenset(choice_ids[db_question.id]),
+        )
+        for db_question in db_questions
+    }
+    return PollRuntime(poll_id=db_poll.id, poll_uuid=str(db_poll.uuid), questions=questions)
+
+
+class PollRuntimeCache:
+    """
+    Ограниченный LRU кэш скомпилированных опросов по UUID опроса
+
+    invalidate сбрасывает запись только в своем процессе, поэтому записи живут
+    не дольше ttl секунд - так ограничено устаревание после изменения опроса
+    (например удаления вопроса) на другом воркере.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 10.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[float, PollRuntime]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, poll_uuid: UUID) -> Optional[PollRuntime]:
+        key = str(poll_uuid)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, runtime = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return runtime
+
+    def put(self, runtime: PollRuntime) -> None:
+        with self._lock:
+            self._items[runtime.poll_uuid] = (time.monotonic() + self.ttl, runtime)
+            self._items.move_to_end(runtime.poll_uuid)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, poll_uuid: UUID) -> None:
+        with self._lock:
+            self._items.pop(str(poll_uuid), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+poll_runtime_cache = PollRuntimeCache(maxsize=config.POLL_RUNTIME_CACHE_SIZE, ttl=config.POLL_RUNTIME_CACHE_TTL_SECONDS)
+
+
+def get_poll_runtime(db: Session, db_poll: models.Poll) -> PollRuntime:
+    """
+    Получение скомпилированного опроса из кэша, при промахе - сборка и сохранение
+
+    :param db: сессия БД
+    :param db_poll: модель опроса
+    :return: PollRuntime
+    """
+    runtime = poll_runtime_cache.get(db_poll.uuid)
+    if runtime is None:
+        runtime = compile_poll_runtime(db, db_poll)
+        poll_runtime_cache.put(runtime)
+    return runtime
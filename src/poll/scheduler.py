@@ -1,64 +1,302 @@
 import asyncio
-from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
+import heapq
+import itertools
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
 from sqlalchemy.orm import Session
-from company import models
-from api.utils.logger import PollLogger
-from uuid import UUID
 
-from poll.service import get_sessions_by_poll_uuid
-from motor.motor_asyncio import AsyncIOMotorCollection
-from fastapi import Depends
-from api.utils.db import get_db, get_mongo_db
+from core import config
+from api.utils.logger import PollLogger
+from db.session import SessionLocal
+from pkg.mongo_tools.db import get_mongo_collection
+from . import models
+from .models import PollStatus
+from .payload_cache import invalidate_poll_caches
+from .admission import reset_poll_counter
+from .snapshot import materialize_results_snapshot
+from .publication import get_publish_error
 
 # Logging
-custom_logger = PollLogger(__name__)
 logger = PollLogger(__name__)
 
+# Виды событий планировщика
+EVENT_PUBLISH = "publish"
+EVENT_END = "end"
+EVENT_SESSIONS = "sessions"
+
+
+def poll_end_at(db_poll: models.Poll) -> Optional[datetime]:
+    """ Время автоматического завершения опроса: active_from + active_duration минут"""
+    if db_poll.active_from is None or db_poll.active_duration is None:
+        return None
+    return db_poll.active_from + timedelta(minutes=db_poll.active_duration)
+
 
-async def check_sessions_expiration(poll_uuid: UUID,  db_mongo: AsyncIOMotorCollection = Depends(get_mongo_db)):
+def load_poll_deadlines(db: Session) -> List[Tuple[datetime, str, int]]:
     """
-    Запуск мониторинга сессий для конкретного опроса
+    Загрузка предстоящих событий публикации и завершения опросов
+
+    :param db: сессия БД
+    :return: список (время, вид события, id опроса)
+    """
+    db_polls = db.query(models.Poll.id, models.Poll.poll_status, models.Poll.active_from, models.Poll.active_duration) \
+        .filter(models.Poll.active_from.isnot(None)) \
+        .filter(models.Poll.poll_status.in_([PollStatus.DRAFT, PollStatus.PUBLISHED])) \
+        .all()
+    deadlines = []
+    for db_poll in db_polls:
+        if db_poll.poll_status == PollStatus.DRAFT:
+            deadlines.append((db_poll.active_from, EVENT_PUBLISH, db_poll.id))
+        end_at = poll_end_at(db_poll)
+        if end_at is not None:
+            deadlines.append((end_at, EVENT_END, db_poll.id))
+    return deadlines
 
 
-    :param poll_uuid: ID опроса
-    :param db_mongo: Сессия MongoDB
-    :return: None
+def publish_due_poll(poll_id: int) -> Optional[str]:
     """
-    while True:
-        logger.info('Check every session of poll')
-        sessions = await get_sessions_by_poll_uuid(db_mongo=db_mongo, poll_uuid=poll_uuid)
-        for session in sessions:
-            expires_at = session.get("expires_at")
-            if expires_at and expires_at <= datetime.utcnow():
-                logger.info(f'Session {session} expired!')
-                # Сессия истекла, обновляем статус в MongoDB
-                db_mongo.update_one(
-                    {"_id": session["_id"]},
-                    {"$set": {"expired": True}}
-                )
-        await asyncio.sleep(60)
-
-
-async def create_task_session_expiration(poll_uuid: UUID, db_mongo: AsyncIOMotorCollection = Depends(get_mongo_db)):
+    Публикация опроса, если наступило время active_from
+
+    Перед изменением статус и время перечитываются из БД, поэтому устаревшие
+    и повторные события ничего не делают.
+
+    :param poll_id: id опроса
+    :return: UUID опубликованного опроса или None
     """
-        Создание задачи для мониторинга сессий
+    with SessionLocal() as db:
+        db_poll = db.query(models.Poll).filter(models.Poll.id == poll_id).with_for_update().first()
+        if not db_poll or db_poll.poll_status != PollStatus.DRAFT or db_poll.active_from is None:
+            return None
+        if db_poll.active_from > datetime.utcnow():
+            return None
+        publish_error = get_publish_error(db, poll_id)
+        if publish_error:
+            logger.warning(f"Poll {poll_id} cannot be published automatically: {publish_error}")
+            return None
+        db_poll.poll_status = PollStatus.PUBLISHED
+        db_poll.poll_url = f"/poll/{db_poll.uuid}"
+        db.commit()
+        return str(db_poll.uuid)
 
-        :param poll_uuid: ID опроса
-        :param db_mongo: Сессия MongoDB
-        """
-    logger.info('Session task was created')
-    return asyncio.create_task(check_sessions_expiration(poll_uuid, db_mongo))
 
+def end_due_poll(poll_id: int) -> Optional[str]:
+    """
+    Завершение опроса с расчетом снимка результатов, если истекло время active_from + active_duration
 
-async def cancel_task_session_expiration(task: asyncio.Task):
+    :param poll_id: id опроса
+    :return: UUID завершенного опроса или None
     """
-    Отмена задачи мониторинга сессий
+    with SessionLocal() as db:
+        db_poll = db.query(models.Poll).filter(models.Poll.id == poll_id).with_for_update().first()
+        if not db_poll or db_poll.poll_status != PollStatus.PUBLISHED:
+            return None
+        end_at = poll_end_at(db_poll)
+        if end_at is None or end_at > datetime.utcnow():
+            return None
+        db_poll.poll_status = PollStatus.ENDED
+        db_poll.poll_url = None
+        materialize_results_snapshot(db, poll_id)
+        db.commit()
+        return str(db_poll.uuid)
+
+
+class PollDeadlineScheduler:
+    """
+    Планировщик сроков опросов на одной куче (heap)
+
+    Одна задача спит до ближайшего события, выполняет его и засыпает до следующего.
+    События: публикация опроса в active_from, завершение опроса через active_duration
+    минут после active_from и пометка истекших сессий в момент ближайшего expires_at.
+    Затраты зависят от количества событий, а не от количества опросов и сессий.
 
-    :param task: Задача мониторинга сессий
+    События выполняет и состояние из PostgreSQL и MongoDB восстанавливает только
+    воркер-лидер: при получении лидерства и затем каждые POLL_DEADLINE_RESYNC_SECONDS,
+    так он узнает о сроках, назначенных запросами на других воркерах. Остальные
+    воркеры наступившие события пропускают.
     """
-    logger.info('Session task was canceled')
-    task.cancel()
-    await task
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int, str, Optional[int]]] = []
+        self._pending: Dict[Tuple[str, Optional[int]], datetime] = {}
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._leader = None
+        self._synced_at: Optional[datetime] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader is None or self._leader.is_leader
+
+    async def start(self, leader=None) -> None:
+        """
+        Запуск планировщика
+
+        :param leader: выбор лидера с атрибутом is_leader, None - воркер единственный и всегда лидер
+        """
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._leader = leader
+        self._synced_at = None
+        self._task = asyncio.create_task(self._run())
+        logger.info('Poll deadline scheduler started')
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info('Poll deadline scheduler stopped')
+
+    async def rebuild(self) -> None:
+        """ Восстановление событий из БД после рестарта"""
+        self._heap.clear()
+        self._pending.clear()
+        deadlines = await asyncio.to_thread(self._load_deadlines)
+        for due_at, kind, poll_id in deadlines:
+            self._push(due_at, kind, poll_id)
+        await self._schedule_next_session_expiry()
+        self._synced_at = datetime.utcnow()
+        logger.info(f'Poll deadline scheduler loaded {len(self._heap)} events')
+
+    def _needs_resync(self, now: datetime) -> bool:
+        return self._synced_at is None or \
+            now - self._synced_at >= timedelta(seconds=config.POLL_DEADLINE_RESYNC_SECONDS)
+
+    @staticmethod
+    def _load_deadlines():
+        with SessionLocal() as db:
+            return load_poll_deadlines(db)
+
+    def schedule_poll(self, db_poll: models.Poll) -> None:
+        """
+        Планирование публикации и завершения опроса по его active_from и active_duration
+
+        Можно вызывать из любого потока, например из синхронных эндпойнтов.
+
+        :param db_poll: модель опроса
+        """
+        events = []
+        if db_poll.active_from is not None and db_poll.poll_status == PollStatus.DRAFT:
+            events.append((db_poll.active_from, EVENT_PUBLISH, db_poll.id))
+        end_at = poll_end_at(db_poll)
+        if end_at is not None and db_poll.poll_status in (PollStatus.DRAFT, PollStatus.PUBLISHED):
+            events.append((end_at, EVENT_END, db_poll.id))
+        for due_at, kind, poll_id in events:
+            self._push_threadsafe(due_at, kind, poll_id)
+
+    def schedule_session_expiry(self, expires_at: Optional[datetime]) -> None:
+        """
+        Планирование пометки сессий на момент expires_at, если он раньше уже запланированного
+
+        :param expires_at: время истечения новой сессии
+        """
+        if expires_at is None:
+            return
+        current = self._pending.get((EVENT_SESSIONS, None))
+        if current is None or expires_at < current:
+            self._push_threadsafe(expires_at, EVENT_SESSIONS, None)
+
+    def _push_threadsafe(self, due_at: datetime, kind: str, key: Optional[int]) -> None:
+        if self._loop is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._push(due_at, kind, key)
+        else:
+            self._loop.call_soon_threadsafe(self._push, due_at, kind, key)
+
+    def _push(self, due_at: datetime, kind: str, key: Optional[int]) -> None:
+        # Повторное планирование того же события заменяет предыдущее - старая запись в куче пропускается
+        self._pending[(kind, key)] = due_at
+        heapq.heappush(self._heap, (due_at, next(self._counter), kind, key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _pop_due(self, now: datetime) -> List[Tuple[str, Optional[int]]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, _, kind, key = heapq.heappop(self._heap)
+            if self._pending.get((kind, key)) != due_at:
+                continue
+            del self._pending[(kind, key)]
+            due.append((kind, key))
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            leader = self.is_leader
+            if not leader:
+                # Лидер сменится - новый лидер перечитает состояние из БД
+                self._synced_at = None
+            elif self._needs_resync(datetime.utcnow()):
+                try:
+                    await self.rebuild()
+                except Exception as e:
+                    logger.error(f"Error while loading poll deadlines: {e}")
+            for kind, key in self._pop_due(datetime.utcnow()):
+                if not leader:
+                    continue
+                try:
+                    await self._fire(kind, key)
+                except Exception as e:
+                    logger.error(f"Error while handling poll deadline {kind} {key}: {e}")
+            # Просыпаемся не реже интервала продления аренды, чтобы заметить смену лидера
+            timeout = config.SCHEDULER_LEADER_RENEW_SECONDS
+            if self._heap:
+                timeout = min(max((self._heap[0][0] - datetime.utcnow()).total_seconds(), 0), timeout)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, kind: str, key: Optional[int]) -> None:
+        if kind == EVENT_PUBLISH:
+            poll_uuid = await asyncio.to_thread(publish_due_poll, key)
+            if poll_uuid:
+                invalidate_poll_caches(poll_uuid)
+                logger.info(f"Poll {poll_uuid} was published on schedule")
+        elif kind == EVENT_END:
+            poll_uuid = await asyncio.to_thread(end_due_poll, key)
+            if poll_uuid:
+                invalidate_poll_caches(poll_uuid)
+                # опрос завершен - удаляем все связанные сессии
+                await get_mongo_collection().delete_many({"poll_uuid": poll_uuid})
+                await reset_poll_counter(get_mongo_collection(), poll_uuid)
+                logger.info(f"Poll {poll_uuid} was ended on schedule")
+        elif kind == EVENT_SESSIONS:
+            result = await get_mongo_collection().update_many(
+                {"expired": False, "expires_at": {"$lte": datetime.utcnow()}},
+                {"$set": {"expired": True}}
+            )
+            if result.modified_count:
+                logger.info(f"Sessions marked as expired: {result.modified_count}")
+            await self._schedule_next_session_expiry()
+
+    async def _schedule_next_session_expiry(self) -> None:
+        session = await get_mongo_collection().find_one(
+            {"expired": False, "expires_at": {"$ne": None}},
+            sort=[("expires_at", 1)],
+            projection={"expires_at": True}
+        )
+        if session:
+            self._push(session["expires_at"], EVENT_SESSIONS, None)
 
 
+deadline_scheduler = PollDeadlineScheduler()
@@ -150,6 +150,7 @@ class CreatePoll(CamelModelMixin):
     poll_cover: Optional[str] = None
     poll_status: StatusPoll = StatusPoll.DRAFT
     question: Optional[List[Question]] = []
+    active_from: Optional[datetime] = None
     active_duration: Optional[int] = None
     max_participants: Optional[int] = None
 
@@ -172,10 +173,50 @@ class UpdatePoll(CamelModelMixin):
     poll_cover: Optional[str] = None
     poll_status: Optional[StatusPoll] = StatusPoll.DRAFT
     question: Optional[List[Question]] = []
+    active_from: Optional[datetime] = None
     active_duration: Optional[int] = None
     max_participants: Optional[int] = None
 
 
+# schema for changes applied by poll update
+class PollChangeset(CamelModelMixin):
+    poll_fields: List[str] = []
+    questions_inserted: List[int] = []
+    questions_updated: List[int] = []
+    questions_deleted: List[int] = []
+    choices_inserted: List[int] = []
+    choices_updated: List[int] = []
+    choices_deleted: List[int] = []
+
+
+class PollUpdateResult(CamelModelMixin):
+    message: str
+    changes: PollChangeset
+
+
+# schema for polls created by distributing a template
+class DistributedPolls(CamelModelMixin):
+    message: str
+    poll_ids: List[int] = []
+
+
+# schemas for bulk poll import report
+class PollImportItem(CamelModelMixin):
+    item: int
+    source: str
+    status: str
+    poll_id: Optional[int] = None
+    title: Optional[str] = None
+    errors: List[str] = []
+
+
+class PollImportReport(CamelModelMixin):
+    total: int = 0
+    created: int = 0
+    failed: int = 0
+    items: List[PollImportItem] = []
+
+
 class PollStatusUpdate(CamelModelMixin):
     poll_status: StatusPoll
 
@@ -317,6 +358,7 @@ class Option(CamelModelMixin):
 
 
 class UserResponse(CamelModelMixin):
+    responseId: Optional[int] = None
     questionId: int
     questionText: str
     answerType: QuestionType
@@ -336,6 +378,52 @@ class PollStatsResponse(CamelModelMixin):
 
     responses: List[UserResponse]
     stats: List[QuestionStats]
+    next_cursor: Optional[int] = None
+
+
+class PollResponsesPage(CamelModelMixin):
+    responses: List[UserResponse]
+    next_cursor: Optional[int] = None
+
+
+class ChoiceTallyItem(CamelModelMixin):
+    question_id: int
+    choice_id: int
+    text: str
+    count: int
+
+
+class CrossTabFilter(CamelModelMixin):
+    """ Условие сегмента: участник выбрал хотя бы один из вариантов вопроса"""
+    question_id: int
+    choice_ids: List[int] = Field(..., min_length=1)
+
+
+class CrossTabRequest(CamelModelMixin):
+    filters: List[CrossTabFilter] = []
+    breakdown_question_id: int
+    segment_question_id: Optional[int] = None
+
+
+class CrossTabItem(CamelModelMixin):
+    choice_id: int
+    text: str
+    count: int
+    share: float
+
+
+class CrossTabSegment(CamelModelMixin):
+    choice_id: Optional[int] = None
+    text: Optional[str] = None
+    respondents: int
+    items: List[CrossTabItem]
+
+
+class CrossTabResponse(CamelModelMixin):
+    total_respondents: int
+    matched_respondents: int
+    breakdown_question_id: int
+    segments: List[CrossTabSegment]
 
 
 # # Модель для списка результатов опроса
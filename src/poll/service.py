@@ -10,7 +10,7 @@ from sqlalchemy import func, desc
 from starlette.responses import RedirectResponse, JSONResponse
 from starlette import status
 
-from sqlalchemy.orm import Session, joinedload, class_mapper, RelationshipProperty
+from sqlalchemy.orm import Session, joinedload, selectinload, class_mapper, RelationshipProperty
 from motor.motor_asyncio import AsyncIOMotorCollection
 from sqlalchemy.orm.session import make_transient
 
@@ -18,7 +18,9 @@ from sqlalchemy import func, extract
 from collections import Counter
 
 from api.utils.db import get_mongo_db
+from user.models import User
 from core.jwt import create_anonymous_user_token
+from core import config
 from core.local_config import settings
 # from pkg.mongo_tools.db import mongo_manager
 
@@ -28,44 +30,32 @@ from base.service import CRUDBase
 from mimetypes import guess_type
 from typing import Optional
 
-from uuid import UUID, uuid4
+from uuid import UUID
 
 from .models import PollStatus, Response
 from .schemas import QuestionType, StatusPoll
 from api.utils.logger import PollLogger
 from .session_data import SessionData
+from .submission import prepare_response_rows, prepare_storage_rows, insert_storage_rows
+from .payload_cache import published_poll_cache, invalidate_poll_caches
+from .ingest import response_ingest_buffer
+from db.executor import db_executor
+from .scheduler import deadline_scheduler
+from .stats import get_responses_page
+from .clone import clone_polls
+from .publication import get_publish_error
+from .diff import apply_poll_questions, insert_questions, question_rows
+from .tree import get_poll_tree_json, get_published_poll_tree_json
+from .tally import delete_poll_tallies, get_live_choice_counts
+from .snapshot import (materialize_results_snapshot, delete_results_snapshot, get_or_create_results_snapshot,
+                       decompress_stats)
+from .admission import admit_participant, release_participant, register_completed_participant, \
+    reset_poll_counter
 
 # Logging
 logger = PollLogger(__name__)
 
 
-def sqlalchemy_to_pydantic(poll: models.Poll):
-    """ Типа костыль для преобразования инстанса модели опроса в модель Pydantic"""
-    questions = []
-    for db_question in poll.question:
-        choices = []
-        for db_choice in db_question.choice:
-            choice_pydantic = schemas.Choice(
-                text=db_choice.text,
-                choice_cover=db_choice.choice_cover
-            )
-            choices.append(choice_pydantic)
-        question_pydantic = schemas.Question(
-            type=db_question.type,
-            text=db_question.text,
-            choice=choices
-        )
-        questions.append(question_pydantic)
-    poll_pydantic = schemas.CreatePoll(
-        title=poll.title,
-        description=poll.description,
-        poll_cover=poll.poll_cover,
-        poll_status=poll.poll_status,
-        question=questions
-    )
-    return poll_pydantic
-
-
 # TODO доделать класс CRUDBase для Poll
 class CRUDPoll(CRUDBase[schemas.Poll, schemas.CreatePoll, schemas.UpdatePoll]):
     # create new poll with questions
@@ -92,19 +82,35 @@ def get_single_poll(db: Session, poll_id: int, user_id: int):
     """ Get user poll with all questions and choices in it"""
     return (
         db.query(models.Poll)
-        .options(joinedload(models.Poll.question)
-                 .joinedload(models.Question.choice))
+        .options(selectinload(models.Poll.question)
+                 .selectinload(models.Question.choice))
         .filter(models.Poll.id == poll_id)
         .filter(models.Poll.user_id == user_id)
         .first())
 
 
+# get single poll by id as JSON assembled in Postgres
+def get_single_poll_json(db: Session, poll_id: int, user_id: int) -> bytes:
+    """
+    JSON опроса пользователя со всеми вопросами и вариантами ответа одним запросом
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param user_id: id пользователя
+    :return: JSON опроса в формате SinglePoll
+    """
+    payload = get_poll_tree_json(db, poll_id, user_id)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Poll not found")
+    return payload
+
+
 # get single poll by uuid with questions and choices
 def get_poll_by_uuid(db: Session, uuid: UUID):
     """ Get user poll with all questions and choices in it by UUID"""
     poll = db.query(models.Poll) \
-        .options(joinedload(models.Poll.question)
-                 .joinedload(models.Question.choice)) \
+        .options(selectinload(models.Poll.question)
+                 .selectinload(models.Question.choice)) \
         .filter(models.Poll.uuid == uuid).first()
     if poll is None:
         raise HTTPException(status_code=404, detail="Poll not found")
@@ -122,20 +128,44 @@ def get_poll_by_uuid(db: Session, uuid: UUID):
         )
 
 
+# render published poll for respondents
+def render_published_poll(db: Session, uuid: UUID) -> Optional[bytes]:
+    """
+    JSON опубликованного опроса со всеми вопросами и вариантами ответа для кэша
+
+    :param db: сессия БД
+    :param uuid: UUID опроса
+    :return: JSON опроса или None, если опрос не опубликован
+    """
+    return get_published_poll_tree_json(db, uuid)
+
+
+# get published poll payload through cache
+def get_published_poll_payload(db: Session, uuid: UUID) -> Optional[bytes]:
+    """
+    JSON опубликованного опроса из кэша - при одновременном открытии ссылки опрос загружается один раз
+
+    :param db: сессия БД
+    :param uuid: UUID опроса
+    :return: JSON опроса или None, если опрос не опубликован
+    """
+    return published_poll_cache.get_or_load(uuid, lambda: render_published_poll(db, uuid))
+
+
 # create list questions with nested choices - for creating poll
 def create_question(db: Session, questions: List[schemas.Question], poll_id: int) -> None:
-    db_questions = []
+    """
+    Создание вопросов с вариантами ответа в транзакции вызывающего кода
 
-    for question in questions:
-        db_question = models.Question(**question.model_dump(exclude={"choice"}), poll_id=poll_id)
+    Вопросы вставляются одним INSERT ... RETURNING id, варианты ответа - одним многострочным INSERT,
+    фиксирует транзакцию вызывающий код.
 
-        db.add(db_question)
-        db.flush()
-        db.refresh(db_question)
-        db_choice = [models.Choice(**choice.model_dump(), question_id=db_question.id) for choice in question.choice]
-        db.add_all(db_choice)
-        db_questions.append(db_question)
-    db.commit()
+    :param db: сессия БД
+    :param questions: вопросы с вариантами ответа
+    :param poll_id: id опроса
+    """
+    if questions:
+        insert_questions(db, poll_id, question_rows(questions))
 
 
 # create new poll with questions and choices
@@ -149,12 +179,14 @@ def create_new_poll(db: Session, poll: schemas.CreatePoll, user_id: int):
     :return: Model Poll
     """
     db_poll = models.Poll(**poll.model_dump(exclude={"question"}), user_id=user_id)
+    db.add(db_poll)
+    db.flush()
     if poll.poll_status == StatusPoll.PUBLISHED:
         db_poll.poll_url = f"/poll/{db_poll.uuid}"
-    db.add(db_poll)
+    create_question(db=db, questions=poll.question, poll_id=db_poll.id)
     db.commit()
     db.refresh(db_poll)
-    create_question(db=db, questions=poll.question, poll_id=db_poll.id)
+    deadline_scheduler.schedule_poll(db_poll)
     return db_poll
 
 
@@ -186,24 +218,45 @@ def clone_poll_by_id(db: Session, poll_id, user_id: int):
     :param user_id: User ID
     :return new_poll: Poll
     """
-    original_poll = get_single_poll(db, poll_id, user_id)
+    original_poll = db.query(models.Poll.id) \
+        .filter(models.Poll.id == poll_id) \
+        .filter(models.Poll.user_id == user_id) \
+        .first()
     if original_poll is None:
         raise HTTPException(status_code=404, detail="Poll not found")
 
-    poll_pydantic_instance = sqlalchemy_to_pydantic(original_poll)
-    new_uuid = uuid4()
+    new_poll_id, = clone_polls(db, [(poll_id, user_id)])
+    db.commit()
+    return db.get(models.Poll, new_poll_id)
+
 
-    # Исключаем created_at из данных
-    original_poll_data = poll_pydantic_instance.model_dump(exclude={"created_at"})
-    # Устанавливаем новый UUID
-    original_poll_data["uuid"] = new_uuid
-    # Устанавливаем значения по умолчанию
-    original_poll_data["poll_status"] = PollStatus.DRAFT
-    original_poll_data["poll_url"] = ''
-    # Создаем новый опрос с вопросами и вариантами ответов
-    new_poll = create_new_poll(db, schemas.CreatePoll(**original_poll_data), user_id)
+def distribute_poll_to_company(db: Session, poll_id: int, company_id: int, user_id: int) -> List[int]:
+    """
+    Копирование опроса-шаблона всем активным пользователям компании одним запросом
 
-    return new_poll
+    :param db: сессия БД
+    :param poll_id: id исходного опроса
+    :param company_id: id компании
+    :param user_id: id владельца исходного опроса, копию не получает
+    :return: id созданных опросов
+    """
+    original_poll = db.query(models.Poll.id) \
+        .filter(models.Poll.id == poll_id) \
+        .filter(models.Poll.user_id == user_id) \
+        .first()
+    if original_poll is None:
+        raise HTTPException(status_code=404, detail="Poll not found")
+
+    user_ids = [company_user_id for company_user_id, in db.query(User.id)
+                .filter(User.company_id == company_id)
+                .filter(User.is_active.is_(True))
+                .filter(User.id != user_id)
+                .order_by(User.id)
+                .all()]
+    poll_ids = clone_polls(db, [(poll_id, company_user_id) for company_user_id in user_ids])
+    db.commit()
+    logger.info(f"Poll {poll_id} distributed to {len(poll_ids)} users of company {company_id}")
+    return poll_ids
 
 
 # get all user polls
@@ -286,12 +339,12 @@ def update_poll(db: Session, poll_id: int, poll: schemas.UpdatePoll, user_id: in
     :param poll_id: id опроса
     :param poll: схема обновления
     :param user_id: id пользователя
-    :return: обновленный опрос
+    :return: примененный набор изменений
 
     """
 
     # проверка на существование опроса в БД
-    db_poll = db.query(models.Poll).options(joinedload(models.Poll.question).joinedload(models.Question.choice)) \
+    db_poll = db.query(models.Poll) \
         .filter(models.Poll.id == poll_id).filter(models.Poll.user_id == user_id).first()
 
     if not db_poll:
@@ -301,83 +354,112 @@ def update_poll(db: Session, poll_id: int, poll: schemas.UpdatePoll, user_id: in
     if db_poll.poll_status != PollStatus.DRAFT:
         raise HTTPException(status_code=400, detail="Cannot update a non-draft poll")
 
+    changeset = schemas.PollChangeset()
     #  otherwise update poll
     for attr, value in poll.model_dump(exclude={"question"}).items():
-        if value is not None:
+        if value is not None and getattr(db_poll, attr) != value:
             setattr(db_poll, attr, value)
+            changeset.poll_fields.append(attr)
 
     # Если статус Published то генерируем ссылку
     if poll.poll_status == StatusPoll.PUBLISHED:
         db_poll.poll_url == f"/poll/{db_poll.uuid}"
 
-    # Удаляем все связанные варианты ответов
-    db.query(models.Choice).filter(models.Choice.question_id.in_(
-        db.query(models.Question.id).filter(models.Question.poll_id == poll_id)
-    )).delete(synchronize_session=False)
-    # Удаляем все текущие вопросы
-    db.query(models.Question).filter(models.Question.poll_id == poll_id).delete()
-
-    create_question(db=db, questions=poll.question, poll_id=db_poll.id)
+    # Изменяем только отличающиеся вопросы и варианты ответов
+    apply_poll_questions(db, db_poll.id, poll.question or [], changeset)
     db.commit()
+    invalidate_poll_caches(db_poll.uuid)
 
     db.refresh(db_poll)
-    return db_poll
+    deadline_scheduler.schedule_poll(db_poll)
+    logger.info(f"Poll {poll_id} updated: {changeset.model_dump(exclude_defaults=True)}")
+    return changeset
 
 
-# update poll status
-async def update_poll_status(db: Session,
-                             poll_id: int,
-                             db_mongo: AsyncIOMotorCollection,
-                             payload_status: schemas.PollStatusUpdate,
-                             user_id: int):
+# apply new poll status without commit
+def apply_poll_status(db: Session, poll_id: int, payload_status: schemas.PollStatusUpdate, user_id: int):
     """
-    Обновление статуса опроса
+    Проверка и применение нового статуса опроса без фиксации транзакции
 
 
-    :param db:
-    :param poll_id:
-    :param db_mongo:
-    :param payload_status:
-    :param user_id:
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param payload_status: схема обновления статуса
+    :param user_id: id пользователя
     :return: db_poll
     """
-    db_poll = db.query(models.Poll).filter(models.Poll.id == poll_id).filter(models.Poll.user_id == user_id) \
-        .options(joinedload(models.Poll.question)).first()
+    db_poll = db.query(models.Poll).filter(models.Poll.id == poll_id).filter(models.Poll.user_id == user_id).first()
     if not db_poll:
         raise HTTPException(status_code=404, detail="Poll not found")
     # otherwise update poll
     new_status = payload_status.poll_status
     if new_status == StatusPoll.PUBLISHED:
         # При обновлении проверяем есть ли хотя бы один вопрос и один вариант ответа в опросе
-        if not db_poll.question:
-            raise HTTPException(status_code=400, detail="At least one question is required to publish the poll")
-        for question in db_poll.question:
-            if not question.choice:
-                raise HTTPException(status_code=400,
-                                    detail="Each question must have at least one choice to publish the poll")
+        publish_error = get_publish_error(db, poll_id)
+        if publish_error:
+            raise HTTPException(status_code=400, detail=publish_error)
         db_poll.poll_status = PollStatus.PUBLISHED
         db_poll.poll_url = f"/poll/{db_poll.uuid}"
-        db.commit()
     elif new_status == StatusPoll.DRAFT:
         # Сброс URL, если опрос переводится в черновик, завершается вручную удаляем все сессии
         db_poll.poll_url = None
         db_poll.poll_status = PollStatus.DRAFT
-        await db_mongo.delete_many({"poll_uuid": str(db_poll.uuid)})
         db.query(models.Response).filter(models.Response.poll_id == poll_id).delete()
-        db.commit()
+        db.query(models.Submission).filter(models.Submission.poll_id == poll_id).delete()
+        delete_results_snapshot(db, poll_id)
+        delete_poll_tallies(db, poll_id)
     elif new_status == PollStatus.ENDED:
-        # опрос завершен - удаляем все связанные сессии
+        # опрос завершен - удаляем все связанные сессии, результаты больше не меняются
         db_poll.poll_status = PollStatus.ENDED
         db_poll.poll_url = None
-        await db_mongo.delete_many({"poll_uuid": str(db_poll.uuid)})
-        db.commit()
+        materialize_results_snapshot(db, poll_id)
     else:
         raise HTTPException(status_code=400, detail="Invalid poll status")
+    return db_poll
+
 
+def commit_poll_status(db: Session, db_poll: models.Poll):
+    """
+    Фиксация нового статуса опроса
+
+    :param db: сессия БД
+    :param db_poll: модель опроса
+    :return: db_poll
+    """
+    db.commit()
+    invalidate_poll_caches(db_poll.uuid)
     db.refresh(db_poll)
     return db_poll
 
 
+# update poll status
+async def update_poll_status(db: Session,
+                             poll_id: int,
+                             db_mongo: AsyncIOMotorCollection,
+                             payload_status: schemas.PollStatusUpdate,
+                             user_id: int):
+    """
+    Обновление статуса опроса
+
+    Запросы к PostgreSQL выполняются в пуле потоков db_executor, чтобы не блокировать event loop.
+
+
+    :param db:
+    :param poll_id:
+    :param db_mongo:
+    :param payload_status:
+    :param user_id:
+    :return: db_poll
+    """
+    db_poll = await db_executor.run(apply_poll_status, db, poll_id, payload_status, user_id)
+    if db_poll.poll_status in (PollStatus.DRAFT, PollStatus.ENDED):
+        await db_mongo.delete_many({"poll_uuid": str(db_poll.uuid)})
+        await reset_poll_counter(db_mongo, str(db_poll.uuid))
+    db_poll = await db_executor.run(commit_poll_status, db, db_poll)
+    deadline_scheduler.schedule_poll(db_poll)
+    return db_poll
+
+
 # query to delete poll by id
 def delete_poll(db: Session, poll_id: int):
     """"
@@ -390,8 +472,10 @@ def delete_poll(db: Session, poll_id: int):
     db_poll = db.query(models.Poll).filter(models.Poll.id == poll_id).first()
     if not db_poll:
         raise HTTPException(status_code=404, detail="Poll not found")
+    poll_uuid = db_poll.uuid
     db.delete(db_poll)
     db.commit()
+    invalidate_poll_caches(poll_uuid)
     return db_poll
 
 
@@ -408,8 +492,10 @@ def delete_poll_by_user(db: Session, poll_id: int, user_id: int):
     db_poll = db.query(models.Poll).filter(models.Poll.id == poll_id).filter(models.Poll.user_id == user_id).first()
     if not db_poll:
         raise HTTPException(status_code=404, detail="Poll not found")
+    poll_uuid = db_poll.uuid
     db.delete(db_poll)
     db.commit()
+    invalidate_poll_caches(poll_uuid)
     return db_poll
 
 
@@ -434,6 +520,7 @@ def upload_poll_cover(db: Session, file: UploadFile, poll_id: int, user_id: int)
     db_poll.poll_cover = path
     db.add(db_poll)
     db.commit()
+    invalidate_poll_caches(db_poll.uuid)
     return file_name
 
 
@@ -487,55 +574,44 @@ def update_question(db: Session, question_id: int, question: schemas.UpdateQuest
     db.add(db_question)
     db.commit()
     db.refresh(db_question)
+    poll_uuid = db.query(models.Poll.uuid).filter(models.Poll.id == db_question.poll_id).scalar()
+    if poll_uuid:
+        invalidate_poll_caches(poll_uuid)
     return db_question
 
 
 # RESPONSES
 
-# utility common function for creating response in db
-def create_response(db: Session,
-                    db_question: models.Question,
-                    answer_text=None,
-                    answer_choice=None,
-                    user_token=None):
-    """Создание ответа на вопрос - общая функция для всех обработчиков
-
+def get_poll_for_response(db: Session, uuid: UUID) -> models.Poll:
+    """
+    Получение опроса для записи ответов с проверкой что он не завершен
 
     :param db: сессия БД,
-    :param db_question: модель вопроса,
-    :param answer_text: текст ответа для вопроса с текстовым ответом,
-    :param answer_choice: id варианта ответа может быть списков из нескольких элементов
-    :param user_token: токен пользователя,
-    """
-
-    db_response = models.Response(
-        poll_id=db_question.poll_id,
-        question_id=db_question.id,
-        answer_text=answer_text,
-        answer_choice=answer_choice,
-        user_token=user_token
-    )
-    db.add(db_response)
-    db.commit()
-    db.refresh(db_response)
-    return db_response
+    :param uuid: UUID опроса
+    :return: модель опроса
+    """
+    db_poll = db.query(models.Poll).filter_by(uuid=uuid).first()
 
+    #  Проверка на наличие опроса
+    if not db_poll:
+        raise HTTPException(status_code=404, detail="Poll not found for the user")
+    #  Проверка на активность опроса - есть время начала и время окончания опроса
+    if db_poll.is_ended():
+        raise HTTPException(status_code=400, detail="The poll is ended!")
+    return db_poll
 
-# utility function for validate if a choice belongs to a question
-def validate_choice(db: Session, question_id: int, choice_id: int):
-    """
-    Проверка принадлежности варианта ответа к вопросу
 
-    :param db: сессия БД,
-    :param question_id: id вопроса,
-    :param choice_id: id варианта ответа,
-    :return db_choice
+# end poll after the last participant
+def end_poll_with_snapshot(db: Session, db_poll: models.Poll):
     """
-    db_choice = db.query(models.Choice).filter_by(id=choice_id, question_id=question_id).first()
+    Завершение опроса с расчетом снимка результатов в одной транзакции
 
-    if not db_choice:
-        raise HTTPException(status_code=404, detail="Invalid choice ID for this question")
-    return db_choice
+    :param db: сессия БД
+    :param db_poll: модель опроса
+    """
+    db_poll.poll_status = PollStatus.ENDED
+    materialize_results_snapshot(db, db_poll.id)
+    db.commit()
 
 
 # create new response for using in endpoint!!!
@@ -544,7 +620,7 @@ async def create_new_response(db: Session,
                               db_mongo_session: SessionData,
                               db_mongo: AsyncIOMotorCollection = Depends(get_mongo_db),
                               uuid: UUID = None
-                              ) -> List[models.Response]:
+                              ) -> List[dict]:
     """
     Функция для создания ответов на все вопросы в опросе - используется в эндпойнте
 
@@ -556,15 +632,7 @@ async def create_new_response(db: Session,
     :param uuid: UUID опроса
     :return: список созданных ответов
     """
-    # check if the poll exists
-    db_poll = db.query(models.Poll).filter_by(uuid=uuid).first()
-
-    #  Проверка на наличие опроса
-    if not db_poll:
-        raise HTTPException(status_code=404, detail="Poll not found for the user")
-    #  Проверка на активность опроса - есть время начала и время окончания опроса
-    if db_poll.is_ended():
-        raise HTTPException(status_code=400, detail="The poll is ended!")
+    db_poll = await db_executor.run(get_poll_for_response, db, uuid)
 
     # Проверка времени завершения сессии
     expires_at = db_mongo_session["expires_at"]
@@ -573,93 +641,30 @@ async def create_new_response(db: Session,
 
     token = db_mongo_session["token"]
     logger.info(f'Token: {token}')
-    response_objects = []
-    # iterate over the responses and create response objects
     # TODO with a UUID check if already answered using anonymous token
-    for single_response in poll_responses.responses:
-        db_question = db.query(models.Question).filter(models.Question.id == single_response.question_id).first()
-        if not db_question:
-            raise HTTPException(status_code=404,
-                                detail=f"Question with given ID  - {single_response.question_id} not found")
-        # Check the question type and handle the response accordingly
-        question_handler = question_handlers.get(db_question.type)
-        if question_handler is None:
-            raise HTTPException(status_code=500, detail="Invalid question type")
-        db_response = question_handler(db, db_question, single_response, token)
-        response_objects.append(db_response)
-
-    # После сохранения всех ответов, проверяем, все ли пользователи ответили
-    completed_sessions = await db_mongo.count_documents({"poll_uuid": str(uuid), "answered": True})
-    # total_sessions = await db_mongo.count_documents({"poll_uuid": str(uuid)})
-    if db_poll.max_participants is not None and completed_sessions == db_poll.max_participants - 1:
-        db_poll.poll_status = PollStatus.ENDED
-        db.commit()
-    await db_mongo.update_one({"token": token}, {"$set": {"answered": True}})
-
-    return response_objects
-
-
-def handle_single_choice_response(db, db_question: models.Question, response_data: schemas.ResponsePayload, token: str):
-    """
-    Обработчик ответа на вопрос с одним вариантом ответа
-
-
-    :param db: сессия БД,
-    :param db_question: модель вопроса,
-    :param response_data: общая схема для создания ответа на вопрос
-    :param token: токен пользователя,
-    :return create_response
-
-    """
-
-    # check that response data has only choice_id for single choice question
-    if not (response_data.choice_id or response_data.choice_ids) or response_data.choice_text:
-        raise HTTPException(status_code=400, detail="Invalid answer data for single choice question")
-    validate_choice(db, db_question.id, response_data.choice_id)
-    return create_response(db, db_question, answer_choice=[response_data.choice_id], user_token=token)
-
-
-def handle_multiple_choice_response(db, db_question: models.Question, response_data: schemas.ResponsePayload, token: str):
-    """
-    Обработчик ответа на вопрос с несколькими вариантами ответа
-
-
-    :param db: сессия БД,
-    :param db_question: модель вопроса,
-    :param response_data: общая схема для создания ответа на вопрос
-    :return create_response
-    """
-    # check that response data has only choice_ids for multiple choice question
-    if not (response_data.choice_id or response_data.choice_ids) or response_data.choice_text:
-        raise HTTPException(status_code=400, detail="Invalid answer data for multiple choice question")
-    for choice_id in response_data.choice_ids:
-        validate_choice(db, db_question.id, choice_id)
-
-    return create_response(db, db_question, answer_choice=response_data.choice_ids, user_token=token)
-
-
-def handle_text_response(db, db_question: models.Question, response_data: schemas.ResponsePayload, token: str):
-    """
-    Обработчик ответа на вопрос с одним или несколькими текстовыми ответоми
-
-
-    :param db: сессия БД,
-    :param db_question: модель вопроса,
-    :param response_data: схема для создания ответа на вопрос с текстовым ответом"""
-
-    # check that response data has only answer_text for text question
-    if not response_data.choice_text or response_data.choice_id or response_data.choice_ids:
-        raise HTTPException(status_code=400, detail="Invalid answer data for text question")
-    return create_response(db, db_question, answer_text=response_data.choice_text, user_token=token)
-
-
-# Map question type to handler function
-question_handlers = {
-    "SINGLE ANSWER": handle_single_choice_response,
-    "PLURAL ANSWER": handle_multiple_choice_response,
-    "FREE ANSWER": handle_text_response,  # multiple text
-    "FREE TEXT ANSWER": handle_text_response  # single text
-}
+    # Проверяем все ответы до записи, затем сохраняем их одним INSERT
+    response_rows = await db_executor.run(prepare_response_rows, db, db_poll, poll_responses, token)
+    storage = db_poll.response_storage
+    storage_rows = prepare_storage_rows(storage, response_rows)
+    max_participants = db_poll.max_participants
+    # Опрос с лимитом участников завершается по счетчику завершивших, поэтому его ответы
+    # пишутся синхронно: к моменту расчета снимка записаны ответы всех участников
+    if max_participants is not None or not await response_ingest_buffer.submit(storage_rows, storage):
+        # Буфер выключен или переполнен - пишем синхронно
+        await db_executor.run(insert_storage_rows, db, storage, storage_rows)
+
+    await db_executor.run(db.commit)
+
+    # Счетчик завершивших увеличивается только при первой пометке сессии как answered
+    marked = await db_mongo.update_one({"token": token, "answered": False}, {"$set": {"answered": True}})
+    if marked.modified_count and max_participants is not None:
+        completed_participants = await register_completed_participant(db_mongo, str(uuid))
+        # Ровно один запрос увидит значение равное лимиту и завершит опрос
+        if completed_participants == max_participants:
+            await db_executor.run(end_poll_with_snapshot, db, db_poll)
+            invalidate_poll_caches(uuid)
+
+    return response_rows
 
 
 # delete question from the user poll
@@ -682,101 +687,95 @@ def delete_question(db: Session, poll_id: int, question_id: int, user_id: int):
         models.Question.poll_id == poll_id).first()
     if not db_question:
         raise HTTPException(status_code=404, detail="Question not found")
+    poll_uuid = db_poll.uuid
     db.delete(db_question)
     db.commit()
+    invalidate_poll_caches(poll_uuid)
     return db_question
 
 
-# get stats for all responses from poll
-def get_poll_stats_responses(db: Session, poll_id: int, user_id: int):
+# get ended user poll for results
+def get_ended_user_poll(db: Session, poll_id: int, user_id: int):
     """
-    Получение статистики по ответам на опрос
+    Получение завершенного опроса пользователя для просмотра результатов
 
-    :param db:
-    :param poll_id:
-    :param user_id:
-    :return: responses
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param user_id: id пользователя
+    :return: строка (id, poll_status)
     """
-    db_poll = (
-        db.query(models.Poll)
-        .options(
-            joinedload(models.Poll.question).joinedload(models.Question.choice)
-        )
-        .filter(models.Poll.id == poll_id)
-        .filter(models.Poll.user_id == user_id)
+    db_poll = db.query(models.Poll.id, models.Poll.poll_status) \
+        .filter(models.Poll.id == poll_id) \
+        .filter(models.Poll.user_id == user_id) \
         .first()
-    )
     if not db_poll:
         raise HTTPException(status_code=404, detail="Poll not found")
 
     # Проверка статуса опроса
     if db_poll.poll_status != PollStatus.ENDED:
         raise HTTPException(status_code=400, detail="Poll results are not available until the poll has ended")
+    return db_poll
 
-    responses = []
-    stats = []
-
-    # Сбор статистики по ответам на вопросы и сами ответы
-    for question in db_poll.question:
-        # Получаем все ответы на текущий вопрос
-        question_responses = question.response
-        # Собираем статистику по ответам
-        answer_stats = {}
-        # Собираем индивидуальные ответы пользователей
-        for response in question_responses:
-            # Структура для хранения индивидуального ответа
-            user_response = {
-                "questionId": question.id,
-                "questionText": question.text,
-                "answerType": question.type.value,
-                "selectedOptionIds": response.answer_choice or [],
-                "answerText": response.answer_text or "",
-                "userToken": response.user_token
-            }
-            responses.append(user_response)
-
-            # if response.answer_choice:
-            #     # Если ответ представляет собой выбор
-            #     for choice_id in response.answer_choice:
-            #         # Получаем текст выбора из уже загруженных данных
-            #         choice_text = next((choice.text for choice in question.choice if choice.id == choice_id),
-            #                            "Неизвестный выбор")
-            #         # user_response["selectedOptionIds"].append(choice_id)
-            #         # Статистика ответов пользователя
-            #         if choice_text not in answer_stats:
-            #             answer_stats[choice_text] = 1
-            #         else:
-            #             answer_stats[choice_text] += 1
-            # elif response.answer_text:
-            #     # Если ответ представляет собой текст
-            #     # user_response["answerText"] = response.answer_text
-            #     # Статистика ответов пользователя
-            #     if response.answer_text not in answer_stats:
-            #         answer_stats[response.answer_text] = 1
-            #     else:
-            #         answer_stats[response.answer_text] += 1
-
-            if question.type == "PLURAL ANSWER" or question.type == "SINGLE ANSWER":
-                for choice_id in response.answer_choice:
-                    choice_text = next((choice.text for choice in question.choice if choice.id == choice_id),
-                                       "Неизвестный выбор")
-                    answer_stats[choice_text] = answer_stats.get(choice_text, 0) + 1
-            elif question.type == "FREE ANSWER" and response.answer_text:
-                answer_stats[response.answer_text] = answer_stats.get(response.answer_text, 0) + 1
-
-        stats.append(
-            {
-                "questionId": question.id,
-                "answerType": question.type.value,
-                "questionText": question.text,
-                "items": answer_stats
-            }
-        )
+
+# get live choice counts of published or ended poll
+def get_poll_live_counts(db: Session, poll_id: int, user_id: int):
+    """
+    Получение текущих счетчиков вариантов ответа опроса
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param user_id: id пользователя
+    :return: список ChoiceTallyItem
+    """
+    db_poll = db.query(models.Poll.id, models.Poll.poll_status) \
+        .filter(models.Poll.id == poll_id) \
+        .filter(models.Poll.user_id == user_id) \
+        .first()
+    if not db_poll:
+        raise HTTPException(status_code=404, detail="Poll not found")
+    if db_poll.poll_status not in (PollStatus.PUBLISHED, PollStatus.ENDED):
+        raise HTTPException(status_code=400, detail="Live counts are available only for published polls")
+    return get_live_choice_counts(db, poll_id)
+
+
+# get stats for all responses from poll
+def get_poll_stats_responses(db: Session, poll_id: int, user_id: int):
+    """
+    Получение статистики по ответам на опрос
+
+    Статистика берется из снимка результатов, рассчитанного при завершении опроса.
+    Индивидуальные ответы отдаются только первой страницей, остальные - через
+    get_poll_responses_page по курсору nextCursor.
+
+    :param db:
+    :param poll_id:
+    :param user_id:
+    :return: responses
+    """
+    get_ended_user_poll(db, poll_id, user_id)
+    first_page = get_responses_page(db, poll_id, after_id=None, limit=config.STATS_RESPONSES_PAGE_SIZE)
     return {
-        "responses": responses,
-        "stats": stats
+        "responses": first_page["responses"],
+        "stats": decompress_stats(get_or_create_results_snapshot(db, poll_id).data),
+        "nextCursor": first_page["nextCursor"]
     }
 
+
+# get page of individual responses from poll
+def get_poll_responses_page(db: Session, poll_id: int, user_id: int, after_id: Optional[int], limit: int):
+    """
+    Получение страницы индивидуальных ответов на опрос
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param user_id: id пользователя
+    :param after_id: курсор - id последнего ответа предыдущей страницы
+    :param limit: размер страницы
+    :return: словарь PollResponsesPage
+    """
+    get_ended_user_poll(db, poll_id, user_id)
+    return get_responses_page(db, poll_id, after_id=after_id, limit=limit)
+
 #
 # async def get_all_poll_responses(db: Session, poll_id: int, user_id: int):
 #     """
@@ -819,7 +818,7 @@ async def create_user_session(db: Session, uuid: UUID,
     :param fingerprint: ID из FingerprintJS
     """
 
-    poll = get_poll_by_uuid(db=db, uuid=uuid)
+    poll = await db_executor.run(get_poll_by_uuid, db=db, uuid=uuid)
     if not poll:
         raise HTTPException(status_code=404, detail="Published Poll not found")
     if poll.poll_status == PollStatus.ENDED:
@@ -830,25 +829,32 @@ async def create_user_session(db: Session, uuid: UUID,
 
     max_participants = poll.max_participants
     if max_participants is not None:
-        current_participants = await db_mongo.count_documents({"poll_uuid": str(uuid)})
-        if current_participants == max_participants:
+        # Атомарно занимаем место участника
+        if not await admit_participant(db_mongo, str(uuid), max_participants):
             raise HTTPException(status_code=400, detail="Maximum participants reached for this poll.")
-        # elif current_participants == max_participants - 1:
-        #     poll.poll_status = PollStatus.CLOSED
-        #     db.commit()
 
     expires_at = None
+    purge_at = None
     if poll.active_duration is not None:
         expires_at = datetime.utcnow() + timedelta(minutes=poll.active_duration)
+        # Истекшая сессия хранится еще MONGO_SESSION_RETENTION_DAYS дней и удаляется по TTL
+        purge_at = expires_at + timedelta(days=config.MONGO_SESSION_RETENTION_DAYS)
 
     # создаем объект SessionData и сохраняем сессию опроса в MongoDB
     session_data = SessionData(
         token=token,
         fingerprint=fingerprint.fingerprint,
         poll_uuid=poll.uuid,
-        expires_at=expires_at
+        expires_at=expires_at,
+        purge_at=purge_at
     )
-    result = await db_mongo.insert_one(document=session_data.to_dict())
+    try:
+        result = await db_mongo.insert_one(document=session_data.to_dict())
+    except Exception:
+        if max_participants is not None:
+            await release_participant(db_mongo, str(uuid))
+        raise
+    deadline_scheduler.schedule_session_expiry(expires_at)
     session_id = result.inserted_id
     return session_id, token
 
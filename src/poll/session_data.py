@@ -24,6 +24,8 @@ class SessionData:
         Bool - статус указывающий что сессия истекла
     answered: (по умолчанию False)
         Bool - статус указывающий что пользователь дал ответ на опрос
+    purge_at: (по умолчанию None)
+        Datetime поле - время удаления документа сессии по TTL индексу
 
     """
     token: str
@@ -33,6 +35,7 @@ class SessionData:
     expired: bool = field(default=False)
     answered: bool = field(default=False)
     session_status: str = field(default='')
+    purge_at: Optional[datetime] = field(default=None)
 
     def __post_init__(self):
         self.poll_uuid = str(self.poll_uuid)
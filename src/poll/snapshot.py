@@ -0,0 +1,107 @@
+import json
+import zlib
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from api.utils.logger import PollLogger
+from . import models
+from .answers import count_answers
+from .stats import build_poll_stats
+
+# Logging
+logger = PollLogger(__name__)
+
+SNAPSHOT_COMPRESS_LEVEL = 6
+
+
+def compress_stats(stats: List[dict]) -> bytes:
+    return zlib.compress(json.dumps(stats, ensure_ascii=False).encode("utf-8"), SNAPSHOT_COMPRESS_LEVEL)
+
+
+def decompress_stats(data: bytes) -> List[dict]:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def materialize_results_snapshot(db: Session, poll_id: int) -> models.PollResultsSnapshot:
+    """
+    Расчет и сохранение снимка результатов завершенного опроса без фиксации транзакции
+
+    Вызывается в той же транзакции, что и перевод опроса в ENDED. Старый снимок
+    удаляется, новый получает новый id - он же версия снимка.
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: снимок результатов
+    """
+    stats = build_poll_stats(db, poll_id)
+    response_count, respondent_count = count_answers(db, poll_id)
+    delete_results_snapshot(db, poll_id)
+    db_snapshot = models.PollResultsSnapshot(
+        poll_id=poll_id,
+        created_at=datetime.utcnow(),
+        response_count=response_count,
+        respondent_count=respondent_count,
+        data=compress_stats(stats)
+    )
+    db.add(db_snapshot)
+    db.flush()
+    logger.info(f"Results snapshot {db_snapshot.id} of poll {poll_id} materialized: {response_count} responses")
+    return db_snapshot
+
+
+def delete_results_snapshot(db: Session, poll_id: int) -> None:
+    """
+    Удаление снимка результатов без фиксации транзакции
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    """
+    db.query(models.PollResultsSnapshot) \
+        .filter(models.PollResultsSnapshot.poll_id == poll_id) \
+        .delete(synchronize_session=False)
+
+
+def delete_results_snapshots(db: Session, poll_ids: Iterable[int]) -> None:
+    """
+    Удаление снимков результатов нескольких опросов без фиксации транзакции
+
+    :param db: сессия БД
+    :param poll_ids: id опросов
+    """
+    poll_ids = set(poll_ids)
+    if not poll_ids:
+        return
+    db.query(models.PollResultsSnapshot) \
+        .filter(models.PollResultsSnapshot.poll_id.in_(poll_ids)) \
+        .delete(synchronize_session=False)
+
+
+def get_results_snapshot(db: Session, poll_id: int) -> Optional[models.PollResultsSnapshot]:
+    return db.query(models.PollResultsSnapshot).filter(models.PollResultsSnapshot.poll_id == poll_id).first()
+
+
+def get_or_create_results_snapshot(db: Session, poll_id: int) -> models.PollResultsSnapshot:
+    """
+    Снимок результатов завершенного опроса
+
+    Для опросов, завершенных до появления снимков, или если снимок был сброшен
+    поздно записанными ответами, снимок рассчитывается при первом чтении.
+
+    :param db: сессия БД
+    :param poll_id: id завершенного опроса
+    :return: снимок результатов
+    """
+    db_snapshot = get_results_snapshot(db, poll_id)
+    if db_snapshot is not None:
+        return db_snapshot
+    try:
+        db_snapshot = materialize_results_snapshot(db, poll_id)
+        db.commit()
+    except IntegrityError:
+        # Снимок одновременно рассчитал другой запрос
+        db.rollback()
+        db_snapshot = get_results_snapshot(db, poll_id)
+    return db_snapshot
@@ -0,0 +1,237 @@
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import cast, func, literal_column, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+
+from db.session import SessionLocal
+from . import models
+from .models import ResponseStorage, TypeQuestion
+from .answers import fetch_answer_page, get_response_storage
+
+UNKNOWN_CHOICE_TEXT = "Неизвестный выбор"
+
+# Типы вопросов с вариантами ответа и с подсчетом текстовых ответов
+CHOICE_QUESTION_TYPES = (TypeQuestion.SINGLE, TypeQuestion.PLURAL)
+COUNTED_TEXT_QUESTION_TYPES = (TypeQuestion.FREE,)
+
+
+def aggregate_choice_counts(db: Session, poll_id: int):
+    """
+    Подсчет выбранных вариантов ответа одним запросом
+
+    Счет идет по индексу response_choice (question_id, choice_id) без разбора JSON,
+    тексты вариантов присоединяются к уже сгруппированным строкам.
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: строки (question_id, choice_id, choice_text, count)
+    """
+    counts = db.query(
+        models.ResponseChoice.question_id,
+        models.ResponseChoice.choice_id,
+        func.count().label("count")
+    ) \
+        .join(models.Question, models.Question.id == models.ResponseChoice.question_id) \
+        .filter(models.Question.poll_id == poll_id) \
+        .group_by(models.ResponseChoice.question_id, models.ResponseChoice.choice_id) \
+        .subquery()
+    return db.query(counts.c.question_id, counts.c.choice_id, models.Choice.text, counts.c.count) \
+        .outerjoin(models.Choice, models.Choice.id == counts.c.choice_id) \
+        .all()
+
+
+def aggregate_text_counts(db: Session, poll_id: int):
+    """
+    Подсчет одинаковых текстовых ответов одним запросом
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: строки (question_id, answer_text, count)
+    """
+    answer_text = cast(models.Response.answer_text, JSONB)
+    answer_value = answer_text.op("#>>")(literal_column("'{}'"))
+    return db.query(
+        models.Response.question_id,
+        answer_value.label("answer_text"),
+        func.count().label("count")
+    ) \
+        .join(models.Question, models.Question.id == models.Response.question_id) \
+        .filter(models.Response.poll_id == poll_id) \
+        .filter(models.Question.type.in_(COUNTED_TEXT_QUESTION_TYPES)) \
+        .filter(func.jsonb_typeof(answer_text) == "string") \
+        .filter(answer_value != "") \
+        .group_by(models.Response.question_id, answer_value) \
+        .all()
+
+
+SUBMISSION_CHOICE_COUNTS_SQL = text("""
+    SELECT counts.question_id, counts.choice_id, choice.text AS choice_text, counts.count
+    FROM (
+        SELECT answer.key::int AS question_id, selected.value AS choice_id, count(*) AS count
+        FROM submission
+        CROSS JOIN LATERAL jsonb_each(submission.answers) AS answer(key, value)
+        CROSS JOIN LATERAL jsonb_array_elements_text(
+            CASE WHEN jsonb_typeof(answer.value -> 'choice') = 'array' THEN answer.value -> 'choice' ELSE '[]'::jsonb END
+        ) AS selected(value)
+        WHERE submission.poll_id = :poll_id
+        GROUP BY answer.key, selected.value
+    ) AS counts
+    LEFT JOIN choice ON choice.id::text = counts.choice_id AND choice.question_id = counts.question_id
+""")
+
+SUBMISSION_TEXT_COUNTS_SQL = text("""
+    SELECT answer.key::int AS question_id, answer.value ->> 'text' AS answer_text, count(*) AS count
+    FROM submission
+    CROSS JOIN LATERAL jsonb_each(submission.answers) AS answer(key, value)
+    JOIN question ON question.id = answer.key::int
+    WHERE submission.poll_id = :poll_id
+      AND question.type::text = ANY(:question_types)
+      AND jsonb_typeof(answer.value -> 'text') = 'string'
+      AND answer.value ->> 'text' <> ''
+    GROUP BY answer.key, answer.value ->> 'text'
+""")
+
+
+def aggregate_submission_choice_counts(db: Session, poll_id: int):
+    """
+    Подсчет выбранных вариантов ответа по анкетам формата submission
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: строки (question_id, choice_id, choice_text, count)
+    """
+    return db.execute(SUBMISSION_CHOICE_COUNTS_SQL, {"poll_id": poll_id}).all()
+
+
+def aggregate_submission_text_counts(db: Session, poll_id: int):
+    """
+    Подсчет одинаковых текстовых ответов по анкетам формата submission
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: строки (question_id, answer_text, count)
+    """
+    question_types = [question_type.name for question_type in COUNTED_TEXT_QUESTION_TYPES]
+    return db.execute(SUBMISSION_TEXT_COUNTS_SQL, {"poll_id": poll_id, "question_types": question_types}).all()
+
+
+def get_poll_questions(db: Session, poll_id: int):
+    """
+    Вопросы опроса без вариантов ответа в порядке отображения
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    """
+    return db.query(models.Question.id, models.Question.type, models.Question.text) \
+        .filter(models.Question.poll_id == poll_id) \
+        .order_by(models.Question.order, models.Question.id) \
+        .all()
+
+
+def build_poll_stats(db: Session, poll_id: int) -> List[dict]:
+    """
+    Статистика ответов по всем вопросам опроса, посчитанная на стороне PostgreSQL
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: список QuestionStats в виде словарей
+    """
+    if get_response_storage(db, poll_id) == ResponseStorage.SUBMISSION:
+        choice_counts = aggregate_submission_choice_counts(db, poll_id)
+        text_counts = aggregate_submission_text_counts(db, poll_id)
+    else:
+        choice_counts = aggregate_choice_counts(db, poll_id)
+        text_counts = aggregate_text_counts(db, poll_id)
+
+    items: Dict[int, Dict[str, int]] = {}
+    for question_id, _, choice_text, count in choice_counts:
+        choice_text = choice_text if choice_text is not None else UNKNOWN_CHOICE_TEXT
+        question_items = items.setdefault(question_id, {})
+        question_items[choice_text] = question_items.get(choice_text, 0) + count
+    for question_id, answer_text, count in text_counts:
+        items.setdefault(question_id, {})[answer_text] = count
+
+    return [
+        {
+            "questionId": question_id,
+            "answerType": question_type.value,
+            "questionText": question_text,
+            "items": items.get(question_id, {})
+        }
+        for question_id, question_type, question_text in get_poll_questions(db, poll_id)
+    ]
+
+
+def fetch_individual_responses(db: Session, poll_id: int, after_id: Optional[int],
+                               limit: int) -> Tuple[List[dict], Optional[int]]:
+    """
+    Индивидуальные ответы респондентов без загрузки ORM объектов
+
+    Постраничная выборка по ключу id строки хранения: следующая страница начинается
+    после последнего id предыдущей, поэтому стоимость не растет с номером страницы.
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param after_id: id последней строки предыдущей страницы
+    :param limit: размер страницы
+    :return: список UserResponse в виде словарей и курсор следующей страницы
+    """
+    questions = {question_id: (question_type, question_text)
+                 for question_id, question_type, question_text in get_poll_questions(db, poll_id)}
+    rows, next_cursor = fetch_answer_page(db, poll_id, after_id, limit)
+    responses = []
+    for row in rows:
+        question = questions.get(row.question_id)
+        if question is None:
+            continue
+        question_type, question_text = question
+        responses.append({
+            "responseId": row.answer_id,
+            "questionId": row.question_id,
+            "questionText": question_text,
+            "answerType": question_type.value,
+            "selectedOptionIds": row.answer_choice or [],
+            "answerText": row.answer_text or "",
+            "userToken": row.user_token
+        })
+    return responses, next_cursor
+
+
+def get_responses_page(db: Session, poll_id: int, after_id: Optional[int], limit: int) -> dict:
+    """
+    Страница индивидуальных ответов с курсором следующей страницы
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param after_id: курсор - id последней строки предыдущей страницы
+    :param limit: размер страницы
+    :return: словарь PollResponsesPage
+    """
+    responses, next_cursor = fetch_individual_responses(db, poll_id, after_id=after_id, limit=limit)
+    return {
+        "responses": responses,
+        "nextCursor": next_cursor
+    }
+
+
+def iter_responses_ndjson(poll_id: int, batch_size: int) -> Iterator[bytes]:
+    """
+    Потоковая выдача всех ответов опроса в формате NDJSON
+
+    Ответы читаются страницами по batch_size в собственной сессии БД,
+    так как сессия запроса закрывается до окончания передачи тела ответа.
+
+    :param poll_id: id опроса
+    :param batch_size: размер страницы выборки
+    :return: строки NDJSON
+    """
+    after_id = None
+    with SessionLocal() as db:
+        while True:
+            responses, after_id = fetch_individual_responses(db, poll_id, after_id=after_id, limit=batch_size)
+            for response in responses:
+                yield json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n"
+            if after_id is None:
+                break
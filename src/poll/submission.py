@@ -0,0 +1,249 @@
+from datetime import datetime
+from typing import FrozenSet, List
+
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .models import ResponseStorage
+from .runtime import QuestionRuntime, get_poll_runtime
+from .tally import (increment_choice_tally, count_selected_choices, response_choice_pairs,
+                    submission_choice_pairs)
+from api.utils.logger import PollLogger
+
+# Logging
+logger = PollLogger(__name__)
+
+
+def validate_choice_ids(allowed_choice_ids: FrozenSet[int], choice_ids: List[int]) -> None:
+    """
+    Проверка принадлежности вариантов ответа к вопросу без обращения к БД
+
+    :param allowed_choice_ids: id вариантов ответа вопроса
+    :param choice_ids: id выбранных вариантов ответа
+    """
+    for choice_id in choice_ids:
+        if choice_id not in allowed_choice_ids:
+            raise HTTPException(status_code=404, detail="Invalid choice ID for this question")
+
+
+def build_response_row(question: QuestionRuntime, answer_text=None, answer_choice=None, user_token=None) -> dict:
+    """
+    Строка для вставки в таблицу response
+
+    :param question: скомпилированный вопрос
+    :param answer_text: текст ответа для вопроса с текстовым ответом
+    :param answer_choice: список id вариантов ответа
+    :param user_token: токен пользователя
+    """
+    return {
+        "poll_id": question.poll_id,
+        "question_id": question.id,
+        "answer_text": answer_text,
+        "answer_choice": answer_choice,
+        "user_token": user_token,
+    }
+
+
+def handle_single_choice_response(question: QuestionRuntime, response_data: schemas.ResponsePayload, token: str) -> dict:
+    """
+    Обработчик ответа на вопрос с одним вариантом ответа
+
+
+    :param question: скомпилированный вопрос,
+    :param response_data: общая схема для создания ответа на вопрос
+    :param token: токен пользователя,
+    :return строка ответа
+    """
+
+    # check that response data has only choice_id for single choice question
+    if not (response_data.choice_id or response_data.choice_ids) or response_data.choice_text:
+        raise HTTPException(status_code=400, detail="Invalid answer data for single choice question")
+    validate_choice_ids(question.choice_ids, [response_data.choice_id])
+    return build_response_row(question, answer_choice=[response_data.choice_id], user_token=token)
+
+
+def handle_multiple_choice_response(question: QuestionRuntime, response_data: schemas.ResponsePayload, token: str) -> dict:
+    """
+    Обработчик ответа на вопрос с несколькими вариантами ответа
+
+
+    :param question: скомпилированный вопрос,
+    :param response_data: общая схема для создания ответа на вопрос
+    :param token: токен пользователя,
+    :return строка ответа
+    """
+    # check that response data has only choice_ids for multiple choice question
+    if not (response_data.choice_id or response_data.choice_ids) or response_data.choice_text:
+        raise HTTPException(status_code=400, detail="Invalid answer data for multiple choice question")
+    validate_choice_ids(question.choice_ids, response_data.choice_ids or [])
+    return build_response_row(question, answer_choice=response_data.choice_ids, user_token=token)
+
+
+def handle_text_response(question: QuestionRuntime, response_data: schemas.ResponsePayload, token: str) -> dict:
+    """
+    Обработчик ответа на вопрос с одним или несколькими текстовыми ответоми
+
+
+    :param question: скомпилированный вопрос,
+    :param response_data: схема для создания ответа на вопрос с текстовым ответом
+    :param token: токен пользователя,
+    :return строка ответа
+    """
+
+    # check that response data has only answer_text for text question
+    if not response_data.choice_text or response_data.choice_id or response_data.choice_ids:
+        raise HTTPException(status_code=400, detail="Invalid answer data for text question")
+    return build_response_row(question, answer_text=response_data.choice_text, user_token=token)
+
+
+# Map question type to handler function
+question_handlers = {
+    "SINGLE ANSWER": handle_single_choice_response,
+    "PLURAL ANSWER": handle_multiple_choice_response,
+    "FREE ANSWER": handle_text_response,  # multiple text
+    "FREE TEXT ANSWER": handle_text_response  # single text
+}
+
+
+def prepare_response_rows(db: Session, db_poll: models.Poll,
+                          poll_responses: schemas.CreatePollResponse, token: str) -> List[dict]:
+    """
+    Проверка всех ответов респондента до записи в БД по скомпилированному опросу
+
+    Ошибка в любом ответе отклоняет всю отправку целиком, поэтому частично
+    сохраненных ответов не бывает.
+
+    :param db: сессия БД
+    :param db_poll: модель опроса
+    :param poll_responses: схема со списком ответов на вопросы опроса
+    :param token: токен пользователя
+    :return: список строк для вставки в таблицу response
+    """
+    poll_runtime = get_poll_runtime(db, db_poll)
+    rows = []
+    for single_response in poll_responses.responses:
+        question = poll_runtime.get_question(single_response.question_id)
+        if question is None:
+            raise HTTPException(status_code=404,
+                                detail=f"Question with given ID  - {single_response.question_id} not found")
+        # Check the question type and handle the response accordingly
+        question_handler = question_handlers.get(question.type)
+        if question_handler is None:
+            raise HTTPException(status_code=500, detail="Invalid question type")
+        rows.append(question_handler(question, single_response, token))
+    return rows
+
+
+def build_response_choice_rows(response_ids: List[int], rows: List[dict]) -> List[dict]:
+    """
+    Строки таблицы response_choice - по одной на каждый выбранный вариант ответа
+
+    :param response_ids: id записанных ответов в порядке rows
+    :param rows: строки ответов
+    :return: строки для вставки в таблицу response_choice
+    """
+    choice_rows = []
+    for response_id, row in zip(response_ids, rows):
+        answer_choice = row.get("answer_choice")
+        if not isinstance(answer_choice, list):
+            continue
+        for choice_id in dict.fromkeys(answer_choice):
+            choice_rows.append({
+                "response_id": response_id,
+                "question_id": row["question_id"],
+                "choice_id": choice_id,
+            })
+    return choice_rows
+
+
+def insert_response_rows(db: Session, rows: List[dict]) -> None:
+    """
+    Запись всех ответов одним многострочным INSERT в текущей транзакции
+
+    Выбранные варианты записываются в response_choice вторым INSERT по id из RETURNING,
+    счетчики choice_tally увеличиваются в той же транзакции.
+    Фиксация транзакции остается за вызывающим кодом.
+
+    :param db: сессия БД
+    :param rows: строки подготовленные в prepare_response_rows
+    """
+    if not rows:
+        return
+    response_ids = db.execute(
+        insert(models.Response).returning(models.Response.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    choice_rows = build_response_choice_rows(response_ids, rows)
+    if choice_rows:
+        db.execute(insert(models.ResponseChoice), choice_rows)
+    increment_choice_tally(db, {row["poll_id"] for row in rows}, count_selected_choices(response_choice_pairs(rows)))
+
+
+def build_submission_row(rows: List[dict]) -> dict:
+    """
+    Строка таблицы submission из строк ответов одного респондента
+
+    :param rows: строки ответов подготовленные в prepare_response_rows
+    :return: строка с картой ответов по id вопроса
+    """
+    answers = {}
+    for row in rows:
+        answer = {}
+        if row.get("answer_choice") is not None:
+            answer["choice"] = row["answer_choice"]
+        if row.get("answer_text") is not None:
+            answer["text"] = row["answer_text"]
+        answers[str(row["question_id"])] = answer
+    return {
+        "poll_id": rows[0]["poll_id"],
+        "user_token": rows[0]["user_token"],
+        "answers": answers,
+        "created_at": rows[0].get("created_at") or datetime.utcnow(),
+    }
+
+
+def insert_submission_rows(db: Session, rows: List[dict]) -> None:
+    """
+    Запись анкет респондентов одним многострочным INSERT в текущей транзакции
+
+    Повторная анкета того же респондента пропускается.
+
+    :param db: сессия БД
+    :param rows: строки подготовленные в build_submission_row
+    """
+    if not rows:
+        return
+    inserted = set(db.execute(
+        pg_insert(models.Submission)
+        .on_conflict_do_nothing(index_elements=["poll_id", "user_token"])
+        .returning(models.Submission.poll_id, models.Submission.user_token),
+        rows
+    ).tuples().all())
+    # Счетчики учитывают только действительно записанные анкеты
+    inserted_rows = [row for row in rows if (row["poll_id"], row["user_token"]) in inserted]
+    increment_choice_tally(db, {row["poll_id"] for row in inserted_rows},
+                           count_selected_choices(submission_choice_pairs(inserted_rows)))
+
+
+def prepare_storage_rows(storage: str, rows: List[dict]) -> List[dict]:
+    """ Строки ответов в формате хранения опроса"""
+    if storage == ResponseStorage.SUBMISSION and rows:
+        return [build_submission_row(rows)]
+    return rows
+
+
+def insert_storage_rows(db: Session, storage: str, rows: List[dict]) -> None:
+    """
+    Запись строк в таблицу формата хранения опроса без фиксации транзакции
+
+    :param db: сессия БД
+    :param storage: формат хранения ответов опроса
+    :param rows: строки подготовленные в prepare_storage_rows
+    """
+    if storage == ResponseStorage.SUBMISSION:
+        insert_submission_rows(db, rows)
+    else:
+        insert_response_rows(db, rows)
@@ -0,0 +1,168 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple, Union
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from api.utils.logger import PollLogger
+from db.session import SessionLocal
+from . import models
+from .models import PollStatus, ResponseStorage
+from .answers import get_response_storage
+from .stats import aggregate_choice_counts, aggregate_submission_choice_counts
+
+# Logging
+logger = PollLogger(__name__)
+
+# Пространство ключей advisory lock счетчиков: (TALLY_LOCK_NAMESPACE, poll_id)
+TALLY_LOCK_NAMESPACE = 7301
+
+Executor = Union[Session, Connection]
+
+
+def count_selected_choices(rows: Iterable[Tuple[int, object]]) -> Counter:
+    """
+    Количество выборов по (question_id, choice_id)
+
+    :param rows: пары (question_id, answer_choice)
+    :return: Counter по (question_id, choice_id)
+    """
+    counts = Counter()
+    for question_id, answer_choice in rows:
+        if not isinstance(answer_choice, list):
+            continue
+        for choice_id in dict.fromkeys(answer_choice):
+            counts[(question_id, int(choice_id))] += 1
+    return counts
+
+
+def response_choice_pairs(rows: List[dict]) -> List[Tuple[int, object]]:
+    return [(row["question_id"], row.get("answer_choice")) for row in rows]
+
+
+def submission_choice_pairs(rows: List[dict]) -> List[Tuple[int, object]]:
+    return [(int(question_id), answer.get("choice"))
+            for row in rows for question_id, answer in row["answers"].items()]
+
+
+def lock_poll_tallies(db: Executor, poll_ids: Iterable[int], shared: bool = True) -> None:
+    """
+    Блокировка счетчиков опросов до конца транзакции
+
+    Запись ответов берет разделяемую блокировку, пересчет - исключительную,
+    поэтому пересчет не теряет увеличения из параллельных транзакций.
+
+    :param db: сессия или соединение БД
+    :param poll_ids: id опросов
+    :param shared: разделяемая блокировка
+    """
+    lock = func.pg_advisory_xact_lock_shared if shared else func.pg_advisory_xact_lock
+    for poll_id in sorted(set(poll_ids)):
+        db.execute(select(lock(TALLY_LOCK_NAMESPACE, poll_id)))
+
+
+def increment_choice_tally(db: Executor, poll_ids: Iterable[int], counts: Counter) -> None:
+    """
+    Увеличение счетчиков вариантов ответа в текущей транзакции
+
+    Один INSERT ... ON CONFLICT DO UPDATE на всю пачку, ключи отсортированы,
+    чтобы параллельные транзакции блокировали строки в одном порядке.
+
+    :param db: сессия или соединение БД
+    :param poll_ids: id опросов записанных ответов
+    :param counts: Counter по (question_id, choice_id)
+    """
+    if not counts:
+        return
+    lock_poll_tallies(db, poll_ids)
+    stmt = pg_insert(models.ChoiceTally).values([
+        {"question_id": question_id, "choice_id": choice_id, "count": count}
+        for (question_id, choice_id), count in sorted(counts.items())
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.ChoiceTally.question_id, models.ChoiceTally.choice_id],
+        set_={"count": models.ChoiceTally.count + stmt.excluded.count}
+    )
+    db.execute(stmt)
+
+
+def delete_poll_tallies(db: Session, poll_id: int) -> None:
+    """
+    Удаление счетчиков опроса без фиксации транзакции
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    """
+    question_ids = select(models.Question.id).where(models.Question.poll_id == poll_id)
+    db.query(models.ChoiceTally) \
+        .filter(models.ChoiceTally.question_id.in_(question_ids)) \
+        .delete(synchronize_session=False)
+
+
+def reconcile_poll_tallies(db: Session, poll_id: int) -> int:
+    """
+    Пересчет счетчиков опроса по сохраненным ответам без фиксации транзакции
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: количество счетчиков
+    """
+    lock_poll_tallies(db, [poll_id], shared=False)
+    if get_response_storage(db, poll_id) == ResponseStorage.SUBMISSION:
+        choice_counts = aggregate_submission_choice_counts(db, poll_id)
+    else:
+        choice_counts = aggregate_choice_counts(db, poll_id)
+    delete_poll_tallies(db, poll_id)
+    # Выборы несуществующих вариантов (choice_text is None) не считаются
+    tallies = [
+        {"question_id": question_id, "choice_id": int(choice_id), "count": count}
+        for question_id, choice_id, choice_text, count in choice_counts
+        if choice_text is not None
+    ]
+    if tallies:
+        db.execute(pg_insert(models.ChoiceTally), tallies)
+    return len(tallies)
+
+
+def reconcile_choice_tallies() -> int:
+    """
+    Пересчет счетчиков всех опубликованных опросов, каждый опрос - отдельная транзакция
+
+    :return: количество пересчитанных опросов
+    """
+    with SessionLocal() as db:
+        poll_ids = [poll_id for poll_id, in db.query(models.Poll.id)
+                    .filter(models.Poll.poll_status == PollStatus.PUBLISHED)
+                    .all()]
+    for poll_id in poll_ids:
+        with SessionLocal() as db:
+            try:
+                reconcile_poll_tallies(db, poll_id)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Failed to reconcile choice tallies of poll {poll_id}: {e}")
+    return len(poll_ids)
+
+
+def get_live_choice_counts(db: Session, poll_id: int) -> List[Dict]:
+    """
+    Текущие счетчики вариантов ответа опроса - чтение O(вариантов) без обращения к ответам
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :return: список ChoiceTallyItem в виде словарей
+    """
+    rows = db.query(models.Choice.question_id, models.Choice.id, models.Choice.text, models.ChoiceTally.count) \
+        .join(models.Question, models.Question.id == models.Choice.question_id) \
+        .outerjoin(models.ChoiceTally, (models.ChoiceTally.question_id == models.Choice.question_id)
+                   & (models.ChoiceTally.choice_id == models.Choice.id)) \
+        .filter(models.Question.poll_id == poll_id) \
+        .order_by(models.Question.order, models.Question.id, models.Choice.id) \
+        .all()
+    return [
+        {"questionId": question_id, "choiceId": choice_id, "text": text or "", "count": count or 0}
+        for question_id, choice_id, text, count in rows
+    ]
@@ -0,0 +1,137 @@
+from typing import List, NamedTuple, Optional, Tuple, Type
+
+from pydantic import BaseModel
+from sqlalchemy import Text, case, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .models import TypeQuestion
+
+# Пустой массив для вопросов без вариантов и опросов без вопросов
+EMPTY_JSON_ARRAY = literal_column("'[]'::json")
+
+Fields = List[Tuple[str, str]]
+
+
+class PollTreeLayout(NamedTuple):
+    """
+    Ключи JSON дерева опроса: пары (ключ JSON, атрибут модели) для опроса, вопроса и варианта ответа
+
+    Атрибут question опроса и choice вопроса - вложенные массивы.
+    """
+    poll: Fields
+    question: Fields
+    choice: Fields
+
+
+def _column_fields(model, *relations: str) -> Fields:
+    """
+    Все колонки модели под своими именами - как при сериализации инстанса модели
+
+    Колонки берутся из таблицы, а не из маппера: обращение к мапперу при импорте модуля
+    вызывает configure_mappers() до загрузки моделей других приложений.
+    """
+    return [(column.key, column.key) for column in model.__table__.columns] + [(name, name) for name in relations]
+
+
+def _schema_fields(schema: Type[BaseModel]) -> Fields:
+    """ Поля схемы под их алиасами - как в ответе с response_model"""
+    return [(field.alias or name, name) for name, field in schema.model_fields.items()]
+
+
+# Формат инстанса модели (jsonable_encoder) - страница прохождения опроса
+MODEL_LAYOUT = PollTreeLayout(
+    poll=_column_fields(models.Poll, "question"),
+    question=_column_fields(models.Question, "choice"),
+    choice=_column_fields(models.Choice),
+)
+
+# Формат схемы SinglePoll - опрос для редактирования владельцем
+SINGLE_POLL_LAYOUT = PollTreeLayout(
+    poll=_schema_fields(schemas.SinglePoll),
+    question=_schema_fields(schemas.Question),
+    choice=_schema_fields(schemas.Choice),
+)
+
+
+def _question_type():
+    """ В БД хранится имя TypeQuestion, в API отдается значение"""
+    return case({question_type.name: question_type.value for question_type in TypeQuestion},
+                value=cast(models.Question.type, Text))
+
+
+def _json_object(model, fields: Fields, nested: dict):
+    args = []
+    for key, attr in fields:
+        if attr in nested:
+            value = nested[attr]
+        elif model is models.Question and attr == "type":
+            value = _question_type()
+        else:
+            value = getattr(model, attr)
+        args.extend([literal_column(f"'{key}'"), value])
+    return func.json_build_object(*args)
+
+
+def poll_tree_query(layout: PollTreeLayout):
+    """
+    Запрос JSON дерева опроса одной строкой
+
+    Вопросы и варианты ответа собираются json_agg в коррелированных подзапросах,
+    поэтому строки не размножаются как при joinedload (опросы x вопросы x варианты).
+    Вопросы упорядочены по order, варианты - по id. JSON возвращается текстом,
+    чтобы драйвер не разбирал его в объекты Python.
+
+    :param layout: ключи JSON
+    :return: select, к которому добавляются условия по Poll
+    """
+    choices = select(func.coalesce(
+        func.json_agg(aggregate_order_by(_json_object(models.Choice, layout.choice, {}), models.Choice.id)),
+        EMPTY_JSON_ARRAY
+    )) \
+        .where(models.Choice.question_id == models.Question.id) \
+        .scalar_subquery()
+    questions = select(func.coalesce(
+        func.json_agg(aggregate_order_by(_json_object(models.Question, layout.question, {"choice": choices}),
+                                         models.Question.order, models.Question.id)),
+        EMPTY_JSON_ARRAY
+    )) \
+        .where(models.Question.poll_id == models.Poll.id) \
+        .scalar_subquery()
+    return select(cast(_json_object(models.Poll, layout.poll, {"question": questions}), Text))
+
+
+def _fetch_tree(db: Session, query) -> Optional[bytes]:
+    payload = db.execute(query).scalar()
+    return payload.encode("utf-8") if payload is not None else None
+
+
+def get_poll_tree_json(db: Session, poll_id: int, user_id: int) -> Optional[bytes]:
+    """
+    JSON опроса пользователя в формате SinglePoll без загрузки моделей и валидации схем
+
+    :param db: сессия БД
+    :param poll_id: id опроса
+    :param user_id: id пользователя
+    :return: JSON опроса или None, если опрос не найден
+    """
+    query = poll_tree_query(SINGLE_POLL_LAYOUT) \
+        .where(models.Poll.id == poll_id) \
+        .where(models.Poll.user_id == user_id)
+    return _fetch_tree(db, query)
+
+
+def get_published_poll_tree_json(db: Session, uuid) -> Optional[bytes]:
+    """
+    JSON опубликованного опроса по UUID в формате модели
+
+    :param db: сессия БД
+    :param uuid: UUID опроса
+    :return: JSON опроса или None, если опрос не опубликован
+    """
+    query = poll_tree_query(MODEL_LAYOUT) \
+        .where(models.Poll.uuid == uuid) \
+        .where(models.Poll.poll_url != "") \
+        .where(models.Poll.poll_status == models.PollStatus.PUBLISHED)
+    return _fetch_tree(db, query)